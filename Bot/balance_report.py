@@ -0,0 +1,70 @@
+import argparse
+import asyncio
+from time import perf_counter
+
+import numpy as np
+
+from combat import Fighter, simulate
+from dto import AttackType, ItemType
+from game_dao import GameAsyncDao
+from world_catalog import WorldCatalog
+
+# Stats of a freshly created person, see GameAsyncEngine.init_person.
+NEW_PERSON = Fighter(hp=100, attack=50, magic_attack=50, armour=0, magic_armour=0)
+
+
+def loadouts(world: WorldCatalog, level):
+    gear = {}
+    for item in world.items.values():
+        if item.item_type != ItemType.POTION and item.req_level == level:
+            gear.setdefault(item.item_type, item)
+    return {
+        'bare': NEW_PERSON,
+        'starter': Fighter.from_items(NEW_PERSON, [world.first_weapon]),
+        f'level {level} set': Fighter.from_items(NEW_PERSON, gear.values()),
+    }
+
+
+async def load_world() -> WorldCatalog:
+    dao = GameAsyncDao()
+    world = WorldCatalog(paths_source='grid')
+    try:
+        await world.load(dao)
+    finally:
+        await dao.dispose()
+    return world
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulates fights of every loadout against every mob in game.db.')
+    parser.add_argument('--fights', type=int, default=100_000, help='fights per scenario')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    world = asyncio.run(load_world())
+    scenarios, labels = [], []
+    for level in sorted({mob.req_level for mob in world.mobs.values()}):
+        for loadout, fighter in loadouts(world, level).items():
+            for attack_type in AttackType.text_to_entry.values():
+                for mob in world.mobs_of_level(level):
+                    scenarios.append((fighter, mob, attack_type))
+                    labels.append((level, loadout, attack_type, f'{mob.id} ({mob.attack_type})'))
+
+    started = perf_counter()
+    report = simulate(scenarios, args.fights, np.random.default_rng(args.seed))
+    elapsed = perf_counter() - started
+
+    print(
+        f"{'level':>5} {'loadout':<14} {'attack':<9} {'mob':<14} "
+        f"{'win rate':>8} {'ttk, s':>7} {'xp/min':>8} {'gold/min':>8}"
+    )
+    for i, (level, loadout, attack_type, mob) in enumerate(labels):
+        print(
+            f'{level:>5} {loadout:<14} {attack_type:<9} {mob:<14} {report.win_rate[i]:>8.1%} '
+            f'{report.time_to_kill[i]:>7.1f} {report.xp_per_minute[i]:>8.1f} {report.gold_per_minute[i]:>8.1f}'
+        )
+    print(f'{len(scenarios) * args.fights} fights in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+from time import perf_counter
+
+from sqlalchemy import create_engine
+
+from dto import meta
+from migrate_db import migrate
+
+QUERIES = {
+    'person by external_id': (
+        'SELECT * FROM person WHERE external_id = ? ORDER BY id DESC LIMIT 1',
+        lambda args: (str(random.randrange(args.players)),),
+    ),
+    'last journey': (
+        'SELECT * FROM journey WHERE person_id = ? ORDER BY arrive_by DESC LIMIT 1',
+        lambda args: (random.randrange(1, args.players + 1),),
+    ),
+    'person item': (
+        'SELECT * FROM person_item WHERE person_id = ? AND item_id = ?',
+        lambda args: (random.randrange(1, args.players + 1), random.randrange(1, 31)),
+    ),
+    'path by endpoints': (
+        'SELECT * FROM path WHERE from_location_id = ? AND to_location_id = ?',
+        lambda args: (random.randrange(1, args.locations + 1), random.randrange(1, args.locations + 1)),
+    ),
+    'item in location': (
+        'SELECT * FROM item_in_location WHERE location_id = ? AND item_id = ?',
+        lambda args: (random.randrange(1, args.locations + 1), random.randrange(1, 31)),
+    ),
+}
+
+
+def fill(connection, args):
+    connection.executemany(
+        'INSERT INTO location (id, x_coord, y_coord, location_type) VALUES (?, ?, ?, ?)',
+        ((i, i % 100, i // 100, 'town') for i in range(1, args.locations + 1)),
+    )
+    connection.executemany(
+        'INSERT INTO path (from_location_id, to_location_id, distance) VALUES (?, ?, ?)',
+        ((i, j, 1) for i in range(1, args.locations + 1) for j in range(1, args.locations + 1) if i != j),
+    )
+    connection.executemany(
+        'INSERT INTO item_in_location (location_id, item_id) VALUES (?, ?)',
+        ((i, j) for i in range(1, args.locations + 1) for j in range(1, 31)),
+    )
+    connection.executemany(
+        'INSERT INTO person (id, nickname, external_id, level, hp, money, location_id) VALUES (?, ?, ?, 1, 100, 250, 1)',
+        ((i, f'p{i}', str(i - 1)) for i in range(1, args.players + 1)),
+    )
+    connection.executemany(
+        'INSERT INTO person_item (person_id, item_id, quantity, put_on) VALUES (?, ?, 1, 0)',
+        ((i, j) for i in range(1, args.players + 1) for j in random.sample(range(1, 31), 3)),
+    )
+    connection.executemany(
+        'INSERT INTO journey (person_id, from_location_id, to_location_id, arrive_by) VALUES (?, 1, 2, ?)',
+        ((random.randrange(1, args.players + 1), random.uniform(0, 1e9)) for _ in range(args.journeys)),
+    )
+    connection.commit()
+
+
+def measure(connection, args):
+    for name, (sql, params) in QUERIES.items():
+        plan = '; '.join(row[-1] for row in connection.execute(f'EXPLAIN QUERY PLAN {sql}', params(args)))
+        start = perf_counter()
+        for _ in range(args.repeat):
+            connection.execute(sql, params(args)).fetchall()
+        elapsed = (perf_counter() - start) / args.repeat * 1000
+        print(f'  {name:<22} {elapsed:10.3f} ms  {plan}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query plans and timings of hot lookups before and after migrate_db.')
+    parser.add_argument('--players', type=int, default=100_000)
+    parser.add_argument('--journeys', type=int, default=1_000_000)
+    parser.add_argument('--locations', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        engine = create_engine(f'sqlite+pysqlite:///{path}')
+        meta.create_all(engine)
+
+        connection = sqlite3.connect(path)
+        for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall():
+            connection.execute(f'DROP INDEX {name}')
+
+        start = perf_counter()
+        fill(connection, args)
+        print(f'filled {args.players} players and {args.journeys} journeys in {perf_counter() - start:.1f} s')
+
+        print('without indexes:')
+        measure(connection, args)
+
+        connection.close()
+
+        start = perf_counter()
+        with engine.begin() as engine_connection:
+            migrate(engine_connection)
+        print(f'migrated in {perf_counter() - start:.1f} s')
+
+        connection = sqlite3.connect(path)
+        print('with indexes:')
+        measure(connection, args)
+        connection.close()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
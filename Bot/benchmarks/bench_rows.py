@@ -0,0 +1,155 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import tracemalloc
+from time import process_time
+
+from sqlalchemy import and_, create_engine, desc
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session, selectinload
+
+import statements
+from dto import Item, Person, PersonItem, meta
+from records import OwnedItem, PersonRecord
+
+
+def fill(connection, args):
+    connection.executemany(
+        "INSERT INTO item (id, cost, cost_to_sale, item_type, hp, mana, attack, magic_attack, armour, magic_armour, "
+        "req_level) VALUES (?, 50, 40, 'weapon', 1, 1, 1, 1, 1, 1, 1)",
+        ((i,) for i in range(1, args.items + 1)),
+    )
+    connection.executemany(
+        'INSERT INTO person (id, nickname, external_id, level, hp, money, attack, magic, magic_attack, xp, armour, '
+        'magic_armour, location_id) VALUES (?, ?, ?, 1, 100, 250, 50, 50, 50, 0, 0, 0, 1)',
+        ((i, f'p{i}', str(i)) for i in range(1, args.players + 1)),
+    )
+    connection.executemany(
+        'INSERT INTO person_item (person_id, item_id, quantity, put_on) VALUES (?, ?, 1, ?)',
+        ((i, j, j % 4 == 0) for i in range(1, args.players + 1) for j in random.sample(range(1, args.items + 1), 8)),
+    )
+    connection.commit()
+
+
+def orm_paths(connection):
+    # What the DAO did before: entities in a fresh session per update, items through selectinload.
+    def person(external_id):
+        with Session(connection) as session:
+            query = select(Person).where(Person.external_id == external_id).order_by(desc(Person.id)).limit(1)
+            result = session.execute(query).scalar()
+            session.expunge_all()
+            return result
+
+    def person_item(person_id, item_id):
+        with Session(connection) as session:
+            query = select(PersonItem)\
+                .options(selectinload(PersonItem.item))\
+                .where(and_(PersonItem.person_id == person_id, PersonItem.item_id == item_id))
+            result = session.execute(query).scalar()
+            session.expunge_all()
+            return result
+
+    def items(person_id):
+        with Session(connection) as session:
+            query = select(PersonItem)\
+                .options(selectinload(PersonItem.item))\
+                .where(PersonItem.person_id == person_id)\
+                .order_by(desc(PersonItem.put_on))
+            result = session.execute(query).scalars().all()
+            session.expunge_all()
+            return result
+
+    return person, person_item, items
+
+
+def core_paths(connection, catalog):
+    # The current path: prebuilt column selects mapped into __slots__ records, items from the in-memory catalog.
+    def person(external_id):
+        row = connection.execute(statements.PLAYER, dict(external_id=external_id)).first()
+        return PersonRecord(*row) if row is not None else None
+
+    def person_item(person_id, item_id):
+        row = connection.execute(statements.PERSON_ITEM, dict(person_id=person_id, item_id=item_id)).first()
+        return OwnedItem(catalog[row.item_id], row.quantity, row.put_on) if row is not None else None
+
+    def items(person_id):
+        rows = connection.execute(statements.ITEMS, dict(person_id=person_id)).all()
+        return [OwnedItem(catalog[row.item_id], row.quantity, row.put_on) for row in rows]
+
+    return person, person_item, items
+
+
+def calls(args, person_items):
+    rng = random.Random(args.seed)
+    person_ids = [rng.randrange(1, args.players + 1) for _ in range(args.calls)]
+    return {
+        'person': [(str(person_id),) for person_id in person_ids],
+        'person_item': [(person_id, rng.choice(person_items[person_id])) for person_id in person_ids],
+        'items': [(person_id,) for person_id in person_ids],
+    }
+
+
+def measure(function, arguments):
+    for call in arguments[:100]:
+        function(*call)
+
+    started = process_time()
+    for call in arguments:
+        function(*call)
+    cpu = (process_time() - started) / len(arguments) * 1e6
+
+    # Bytes still held by the results, and the peak of a single call including its garbage.
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [function(*call) for call in arguments]
+    retained = (tracemalloc.get_traced_memory()[0] - before) / len(arguments)
+    peaks = []
+    for call in arguments[:200]:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        function(*call)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    del results
+    return cpu, retained, sum(peaks) / len(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-call CPU and memory of the ORM and the Core read paths.')
+    parser.add_argument('--players', type=int, default=10_000)
+    parser.add_argument('--items', type=int, default=30)
+    parser.add_argument('--calls', type=int, default=5_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        engine = create_engine(f'sqlite+pysqlite:///{path}')
+        meta.create_all(engine)
+        connection = sqlite3.connect(path)
+        fill(connection, args)
+        person_items = {}
+        for person_id, item_id in connection.execute('SELECT person_id, item_id FROM person_item'):
+            person_items.setdefault(person_id, []).append(item_id)
+        connection.close()
+
+        with engine.connect() as connection:
+            with Session(connection) as session:
+                catalog = {item.id: item for item in session.execute(select(Item)).scalars()}
+                session.expunge_all()
+            arguments = calls(args, person_items)
+            paths = {'orm': orm_paths(connection), 'core': core_paths(connection, catalog)}
+
+            print(f"{'read':<12} {'path':<5} {'cpu, us/call':>13} {'retained, B':>12} {'peak, B/call':>13}")
+            for index, name in enumerate(('person', 'person_item', 'items')):
+                for path_name, functions in paths.items():
+                    cpu, retained, peak = measure(functions[index], arguments[name])
+                    print(f'{name:<12} {path_name:<5} {cpu:>13.1f} {retained:>12.0f} {peak:>13.0f}')
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
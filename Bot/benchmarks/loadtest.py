@@ -0,0 +1,169 @@
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+from collections import Counter, defaultdict
+from time import perf_counter, time
+
+import numpy as np
+
+DEFAULT_MIX = 'stats=25,inventory=15,item_info=10,shop=10,buy=10,sell=5,put_on=5,take_off=5,' \
+              'available_destinations=10,start_journey=3,route=2'
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.requests = Counter()
+        self._message_id = 0
+
+    async def make_request(self, session, server, token, method, data=None, files=None, **kwargs):
+        self.requests[method] += 1
+        self._message_id += 1
+        return {
+            'message_id': self._message_id,
+            'date': int(time()),
+            'chat': {'id': int(data['chat_id']), 'type': 'private'},
+            'text': data.get('text', ''),
+        }
+
+
+class Player:
+    def __init__(self, user_id, world, rng: random.Random):
+        self.user_id = user_id
+        self.world = world
+        self.rng = rng
+
+    def arguments(self, command):
+        # Mostly valid arguments, picked from the static world, so handlers do real work.
+        items = list(self.world.items)
+        locations = list(self.world.locations)
+        if command in ('item_info', 'put_on', 'take_off'):
+            return str(self.rng.choice(items))
+        elif command == 'buy':
+            return ' '.join(f'{self.rng.choice(items)} {self.rng.randint(1, 2)}' for _ in range(self.rng.randint(1, 3)))
+        elif command == 'sell':
+            return f'{self.rng.choice(items)} 1'
+        elif command in ('start_journey', 'route'):
+            return str(self.rng.choice(locations))
+        elif command == 'init_person':
+            return f'player{self.user_id}'
+        return ''
+
+
+def update(update_id, user_id, command, arguments):
+    text = f'/{command} {arguments}'.strip()
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'player{user_id}'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command) + 1}],
+        },
+    }
+
+
+def copy_databases(source, directory):
+    # Shards (SHARD_COUNT) are copied along with game.db, then the bot is pointed at the copies.
+    source_pattern = os.environ.get('SHARD_DATABASE', '')
+    os.environ['GAME_DATABASE'] = os.path.join(directory, 'game.db')
+    os.environ['SHARD_DATABASE'] = os.path.join(directory, 'game.shard{}.db')
+    from sharding import shard_databases
+    import config
+
+    copies = [(source, config.GAME_DATABASE)]
+    if config.SHARD_COUNT > 1:
+        copies += zip(shard_databases(source, pattern=source_pattern), shard_databases())
+    for source_database, target_database in copies:
+        source_connection = sqlite3.connect(source_database)
+        target_connection = sqlite3.connect(target_database)
+        source_connection.backup(target_connection)
+        source_connection.close()
+        target_connection.close()
+
+
+async def run(args):
+    from aiogram import Bot, Dispatcher, types
+    from aiogram.bot import api
+    import bot as game_bot
+    import metrics
+
+    telegram = FakeTelegram()
+    api.make_request = telegram.make_request
+    Bot.set_current(game_bot.bot)
+    Dispatcher.set_current(game_bot.dp)
+
+    mix = dict((name, float(weight)) for name, weight in (pair.split('=') for pair in args.mix.split(',')))
+    commands, weights = list(mix), list(mix.values())
+    rng = random.Random(args.seed)
+    latencies = defaultdict(list)
+    errors = Counter()
+    update_ids = iter(range(1, 1 << 62))
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send(user_id, command, arguments):
+        async with semaphore:
+            started = perf_counter()
+            try:
+                await game_bot.dp.process_update(types.Update(**update(next(update_ids), user_id, command, arguments)))
+            except Exception:
+                errors[command] += 1
+            latencies[command].append(perf_counter() - started)
+
+    async def play(player: Player):
+        await send(player.user_id, 'init_person', player.arguments('init_person'))
+        for command in player.rng.choices(commands, weights, k=args.updates):
+            await send(player.user_id, command, player.arguments(command))
+
+    await game_bot.engine.start()
+    try:
+        players = [
+            Player(args.first_user_id + i, game_bot.engine.world, random.Random(rng.random())) for i in range(args.users)
+        ]
+        started = perf_counter()
+        await asyncio.gather(*(play(player) for player in players))
+        elapsed = perf_counter() - started
+    finally:
+        await game_bot.engine.stop()
+        await game_bot.bot.session.close()
+
+    total = sum(len(x) for x in latencies.values())
+    print(f"{'command':<24} {'count':>7} {'errors':>6} {'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8}")
+    for command, values in sorted(latencies.items()):
+        p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+        print(f'{command:<24} {len(values):>7} {errors[command]:>6} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f}')
+    print(f'{total} updates from {args.users} users in {elapsed:.2f}s: {total / elapsed:.0f} updates/s')
+    print(f'Bot API calls: {dict(telegram.requests)}')
+    if args.metrics:
+        with open(args.metrics, 'w') as file:
+            file.write(metrics.render())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drives the dispatcher with synthetic updates against a copy of game.db.')
+    parser.add_argument('--database', default='game.db', help='database to copy with its shards, never modified')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--updates', type=int, default=50, help='updates per user after /init_person')
+    parser.add_argument('--concurrency', type=int, default=50, help='updates processed at the same time')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='comma separated command=weight pairs')
+    parser.add_argument('--first-user-id', type=int, default=10 ** 9)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--metrics', default=None, help='file to write the Prometheus metrics to')
+    args = parser.parse_args()
+
+    # Bot modules read config.py once, so the environment is complete before the first of them is imported.
+    os.environ.setdefault('BOT_TOKEN', '123456:loadtest')
+    # Simulated players send as fast as they can, the rate limits would reject most of it.
+    os.environ.setdefault('THROTTLE_USER_RATE', '0')
+    os.environ.setdefault('THROTTLE_GLOBAL_RATE', '0')
+    with tempfile.TemporaryDirectory() as directory:
+        copy_databases(args.database, directory)
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
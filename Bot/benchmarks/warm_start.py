@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from benchmarks.loadtest import FakeTelegram, copy_databases, update
+
+# Every hot statement is reached at least once: the player's first item is bought, worn, taken off and sold.
+SEQUENCE = [
+    ('init_person', 'first'), ('stats', ''), ('inventory', ''), ('item_info', '{item}'), ('shop', ''),
+    ('buy', '{item} 2'), ('put_on', '{item}'), ('take_off', '{item}'), ('sell', '{item} 1'),
+    ('available_destinations', ''), ('start_journey', '{location}'),
+]
+
+
+async def measure(first_user_id):
+    # Latency of each command of SEQUENCE for a fresh player, then for a second one as the warmed-up reference.
+    from aiogram import Bot, Dispatcher, types
+    from aiogram.bot import api
+    import bot as game_bot
+
+    api.make_request = FakeTelegram().make_request
+    Bot.set_current(game_bot.bot)
+    Dispatcher.set_current(game_bot.dp)
+
+    started = perf_counter()
+    await game_bot.engine.start()
+    result = {'start': perf_counter() - started, 'first': {}, 'second': {}}
+    try:
+        world = game_bot.engine.world
+        item = world.items_in_location(world.first_location.id, 1)[0].id
+        location = world.paths_from(world.first_location.id)[0].to_location_id
+        for run, user_id in (('first', first_user_id), ('second', first_user_id + 1)):
+            for update_id, (command, arguments) in enumerate(SEQUENCE, start=user_id * 100):
+                arguments = arguments.format(item=item, location=location)
+                started = perf_counter()
+                await game_bot.dp.process_update(types.Update(**update(update_id, user_id, command, arguments)))
+                result[run][command] = perf_counter() - started
+    finally:
+        await game_bot.engine.stop()
+        await (await game_bot.bot.get_session()).close()
+    return result
+
+
+def child(args):
+    with tempfile.TemporaryDirectory() as directory:
+        copy_databases(args.database, directory)
+        print(json.dumps(asyncio.run(measure(args.first_user_id))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='First-request latency after a cold start, with and without WARM_UP.')
+    parser.add_argument('--database', default='game.db', help='database to copy with its shards, never modified')
+    parser.add_argument('--repeat', type=int, default=5, help='fresh processes per mode, medians are printed')
+    parser.add_argument('--first-user-id', type=int, default=10 ** 9)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ.setdefault('BOT_TOKEN', '123456:warmstart')
+    os.environ.setdefault('THROTTLE_USER_RATE', '0')
+    os.environ.setdefault('THROTTLE_GLOBAL_RATE', '0')
+    os.environ.setdefault('METRICS_PORT', '0')
+    if args.child:
+        child(args)
+        return
+
+    # Each start is a new interpreter: mapper configuration and SQLAlchemy's compiled caches only live per process.
+    results = {}
+    for mode, warm_up in (('cold', '0'), ('warm', '1')):
+        results[mode] = []
+        for _ in range(args.repeat):
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.warm_start', '--child', '--database', args.database,
+                 '--first-user-id', str(args.first_user_id)],
+                env={**os.environ, 'WARM_UP': warm_up}, capture_output=True, text=True, check=True,
+            ).stdout
+            results[mode].append(json.loads(output.splitlines()[-1]))
+
+    def median(mode, run, command):
+        return np.median([result[run][command] for result in results[mode]]) * 1000
+
+    print(f"{'command':<24} {'cold, ms':>9} {'warm, ms':>9} {'steady, ms':>11}")
+    for command, _ in SEQUENCE:
+        print(f"{command:<24} {median('cold', 'first', command):>9.2f} {median('warm', 'first', command):>9.2f} "
+              f"{median('warm', 'second', command):>11.2f}")
+    for mode in ('cold', 'warm'):
+        first = np.median([sum(result['first'].values()) for result in results[mode]]) * 1000
+        start = np.median([result['start'] for result in results[mode]]) * 1000
+        print(f'{mode}: engine start {start:.1f} ms, first player sequence {first:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
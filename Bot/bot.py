@@ -1,62 +1,267 @@
 from aiogram import Bot, Dispatcher, executor, types
-from dto import Item
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils.exceptions import MessageNotModified
+from aiohttp import web
+import asyncio
+from contextlib import asynccontextmanager
+import cards
+from commands import CommandSchema, integer, word
+import config
 from game_async_engine import GameAsyncEngine
+import logging
+import metrics
 import os
-import re
+from paging import Cursor, Page
+from player_mailboxes import PlayerMailboxes
 from textwrap import dedent
-
-bot = Bot(token="")
-dp = Dispatcher(bot)
+from throttling import ThrottlingMiddleware
+from time import perf_counter
+from typing import Optional
+
+
+class GameBot(Bot):
+    async def request(self, method, data=None, files=None, **kwargs):
+        await engine.commit()
+        with metrics.BOT_API_SECONDS.time(method):
+            return await super().request(method, data, files, **kwargs)
+
+
+class GameDispatcher(Dispatcher):
+    # Set in webhook mode: a worker slot is taken only once the update's turn in its mailbox has come.
+    limiter: Optional['UpdateLimiter'] = None
+
+    async def process_update(self, update: types.Update):
+        # Updates of one player run one after another, so two quick /buy never read the same balance.
+        # Different players still run in parallel.
+        player_id = _sender_id(update)
+        if player_id is None:
+            return await self._process_update(update)
+
+        mailbox = mailboxes.enter(player_id)
+        if mailbox is None:
+            metrics.UPDATES_SHED.inc()
+            logger.warning('Dropped update %s: player %s has %s updates queued', update.update_id, player_id,
+                           mailboxes.max_depth)
+            return
+        async with mailbox:
+            return await self._process_update(update)
+
+    async def _process_update(self, update: types.Update):
+        if self.limiter is not None:
+            async with self.limiter.slot():
+                return await self._run_update(update)
+        return await self._run_update(update)
+
+    async def _run_update(self, update: types.Update):
+        with metrics.track_update():
+            async with engine.unit_of_work():
+                return await super().process_update(update)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def on_process_message(self, message: types.Message, data: dict):
+        data['metrics_handler'] = current_handler.get().__name__.lstrip('_'), perf_counter()
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        if 'metrics_handler' in data:
+            handler, started = data['metrics_handler']
+            metrics.HANDLER_SECONDS.observe(perf_counter() - started, handler)
+
+    on_process_callback_query = on_process_message
+    on_post_process_callback_query = on_post_process_message
+
+
+class UpdateLimiter:
+    # `pending` counts webhook requests from their arrival, queued in a mailbox or running. Only `concurrency`
+    # of them run at once: the slot is taken inside the mailbox, so updates waiting behind their own player
+    # never hold one and a flooding player cannot starve the others.
+    def __init__(self, concurrency, max_pending):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def full(self):
+        return self.pending >= self.max_pending
+
+    def __enter__(self):
+        self.pending += 1
+
+    def __exit__(self, exc_type, exc, tb):
+        self.pending -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        with metrics.WEBHOOK_WAIT_SECONDS.time():
+            await self._semaphore.acquire()
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class GameWebhookHandler(WebhookRequestHandler):
+    async def post(self):
+        # Updates waiting for a worker pile up when the database falls behind. Past the limit Telegram is told
+        # to come back later instead of the queue growing without bound.
+        if limiter.full():
+            metrics.WEBHOOK_REJECTED.inc()
+            return web.Response(status=503, headers={'Retry-After': str(config.WEBHOOK_RETRY_AFTER)})
+        with limiter:
+            return await super().post()
+
+
+def _sender_id(update: types.Update):
+    event = update.message or update.edited_message or update.callback_query
+    if event is not None and event.from_user is not None:
+        return event.from_user.id
+
+
+logger = logging.getLogger(__name__)
+bot = GameBot(token=config.BOT_TOKEN)
+dp = GameDispatcher(bot)
+dp.middleware.setup(ThrottlingMiddleware())
+dp.middleware.setup(HandlerMetricsMiddleware())
 engine = GameAsyncEngine()
+mailboxes = PlayerMailboxes()
+metrics_server = metrics.MetricsServer()
+limiter = UpdateLimiter(config.WEBHOOK_CONCURRENCY, config.WEBHOOK_MAX_PENDING)
 
 
 def start_bot():
-    executor.start_polling(dp)
+    if config.BOT_MODE == 'webhook':
+        dp.limiter = limiter
+        runner = executor.Executor(dp)
+        runner.on_startup(_on_webhook_startup, polling=False)
+        runner.on_shutdown(_on_webhook_shutdown, polling=False)
+        runner.start_webhook(
+            webhook_path=config.WEBHOOK_PATH,
+            request_handler=GameWebhookHandler,
+            host=config.WEBHOOK_HOST,
+            port=config.WEBHOOK_PORT,
+        )
+    elif config.BOT_MODE == 'polling':
+        executor.start_polling(dp, on_startup=_on_startup, on_shutdown=_on_shutdown)
+    else:
+        raise ValueError(f'Unknown BOT_MODE {config.BOT_MODE!r}, expected polling or webhook')
 
 
-async def _get_person_and_check_state_integrity(message: types.Message):
-    person = await engine.get_person(str(message.from_user.id.real))
-    if person is None:
-        await message.reply("You haven't created a character yet. See /help for more info.")
-        return
-    journey_in_progress = await engine.check_journey_and_update_person(person.id)
-    if journey_in_progress:
-        await message.reply(journey_in_progress)
-        return
-    return person
+async def _on_startup(dispatcher: Dispatcher):
+    await engine.start()
+    await metrics_server.start()
 
 
-async def _extract_item_id(message: types.Message):
-    match = re.search(f'{message.get_command()}\\s+([0-9]+)*\\s*', message.text, re.IGNORECASE)
-    if not match:
-        await message.reply('Please, enter a correct item_id that you own.')
-        return
-    return match.group(1)
+async def _on_shutdown(dispatcher: Dispatcher):
+    await metrics_server.stop()
+    await engine.stop()
+
+
+async def _on_webhook_startup(dispatcher: Dispatcher):
+    await _on_startup(dispatcher)
+    if config.WEBHOOK_URL:
+        await bot.set_webhook(
+            config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH, max_connections=min(config.WEBHOOK_CONCURRENCY, 100),
+        )
+
 
+async def _on_webhook_shutdown(dispatcher: Dispatcher):
+    if config.WEBHOOK_URL:
+        await bot.delete_webhook()
+    await _on_shutdown(dispatcher)
 
-async def _extract_item_id_and_quantity(message: types.Message):
-    match = re.search(f'{message.get_command()}\\s+([0-9]+)*\\s+([0-9]+)*\\s*', message.text, re.IGNORECASE)
-    if not match:
-        await message.reply('Please, enter a correct item_id and quantity')
+
+async def _get_player_state_and_check_integrity(message: types.Message, user: Optional[types.User] = None):
+    # `user` is the player when it is not the sender of `message`, like for a button under the bot's own message.
+    state = await engine.get_player_state(str((user or message.from_user).id.real))
+    if state is None:
+        await message.reply("You haven't created a character yet. See /help for more info.")
         return
-    return match.group(1), match.group(2)
-
-
-def item_string(item: Item):
-    return dedent(
-        f"""\
-        id: {item.id}
-        cost: {item.cost}
-        cost_to_sale: {item.cost_to_sale}
-        item_type: {item.item_type}
-        hp: {item.hp}
-        mana: {item.mana}
-        attack: {item.attack}
-        magic_attack: {item.magic_attack}
-        armour: {item.armour}
-        magic_armour: {item.magic_armour}
-        """
-    )
+    journey_in_progress = await engine.check_journey_and_update_person(state)
+    if journey_in_progress:
+        await message.reply(journey_in_progress)
+        return
+    return state
+
+
+def command(name, schema: Optional[CommandSchema] = None, with_state=True):
+    # Arguments are parsed and validated before the player is loaded, so a malformed command costs no queries.
+    # The handler gets the message, the player state unless with_state is False, then the parsed arguments.
+    def register(handler):
+        async def handle(message: types.Message):
+            args = ()
+            if schema is not None:
+                args = schema.parse(message.get_args())
+                if args is None:
+                    await message.reply(schema.error)
+                    return
+            if with_state:
+                state = await _get_player_state_and_check_integrity(message)
+                if not state:
+                    return
+                args = (state,) + args
+            return await handler(message, *args)
+
+        # Not functools.wraps: aiogram would read the handler's own signature through __wrapped__ and pass it
+        # an FSM `state` keyword. The name is kept for the metrics middleware.
+        handle.__name__ = handle.__qualname__ = handler.__name__
+        dp.register_message_handler(handle, commands=[name])
+        return handler
+    return register
+
+
+ITEM_ID = CommandSchema(integer('item_id'), error='Please, enter a correct item_id that you own.')
+LOCATION_ID = CommandSchema(integer('location_id'), error='Please, enter a correct location_id where you want to go.')
+
+
+def listing(name):
+    # /name sends the first page of a list, Prev and Next buttons under it edit the same message to show the
+    # other pages. The handler gets the message, the player state and a Cursor (None for the first page) and
+    # returns the text and the Page, or None after it replied itself.
+    def register(handler):
+        async def show(message: types.Message, user: types.User, cursor: Optional[Cursor], edit):
+            state = await _get_player_state_and_check_integrity(message, user)
+            if not state:
+                return
+            shown = await handler(message, state, cursor)
+            if shown is None:
+                return
+            text, page = shown
+            if not edit:
+                await message.answer(text, reply_markup=_page_keyboard(name, page))
+                return
+            try:
+                await message.edit_text(text, reply_markup=_page_keyboard(name, page))
+            except MessageNotModified:
+                pass
+
+        async def handle_command(message: types.Message):
+            return await show(message, message.from_user, None, edit=False)
+
+        async def handle_button(query: types.CallbackQuery):
+            await query.answer()
+            return await show(query.message, query.from_user, Cursor.parse(query.data[len(name) + 1:]), edit=True)
+
+        handle_command.__name__ = handle_command.__qualname__ = handler.__name__
+        handle_button.__name__ = handle_button.__qualname__ = f'{handler.__name__}_page'
+        dp.register_message_handler(handle_command, commands=[name])
+        dp.register_callback_query_handler(handle_button, lambda query: (query.data or '').startswith(f'{name}:'))
+        return handler
+    return register
+
+
+def _page_message(header, blocks, page: Page):
+    text, shown = cards.page_text(header, blocks)
+    return text, page.cut(shown)
+
+
+def _page_keyboard(name, page: Page) -> Optional[types.InlineKeyboardMarkup]:
+    buttons = []
+    if page.previous is not None:
+        buttons.append(types.InlineKeyboardButton('« Prev', callback_data=f'{name}:{page.previous}'))
+    if page.next is not None:
+        buttons.append(types.InlineKeyboardButton('Next »', callback_data=f'{name}:{page.next}'))
+    return types.InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
 
 
 @dp.message_handler(commands=['start', 'help'])
@@ -72,192 +277,116 @@ async def _help(message: types.Message):
             /put_on [item_id] – By this command you can wear an item with provided item_id.
             /take_off [item_id] – By this command you can take off an item with provided item_id.
             /shop – If you're currently in a town, you can buy or sell some items. This command says what goods are available here.
-            /buy [item_id] [quantity] – Buy quantity items of provided item_id.
+            /buy [item_id] [quantity] ... – Buy quantity items of provided item_id. Several pairs buy them all at once.
             /sell [item_id] [quantity] – Sell quantity items of provided item_id.
             /available_destinations – Check what locations are available to visit from your location.
             /start_journey [location_id] – Start journey to provided location_id.
+            /route [location_id] – Travel to provided location_id by the shortest chain of journeys.
             """
         ),
     )
 
 
-@dp.message_handler(commands=['init_person'])
-async def _init_person(message: types.Message):
-    match = re.search('/init_person\\s+([a-z0-9]+)*\\s*', message.text, re.IGNORECASE)
-    if not match:
-        await message.reply('Please, enter a correct name. Names can only contain latin letters and numbers.')
-        return
-    nickname = match.group(1)
+@command('init_person', CommandSchema(
+    word('nickname'), error='Please, enter a correct name. Names can only contain latin letters and numbers.',
+), with_state=False)
+async def _init_person(message: types.Message, nickname):
     await engine.init_person(nickname=nickname, external_id=str(message.from_user.id.real))
     await message.reply(f'You successfully created a character with name {nickname}.')
 
 
-@dp.message_handler(commands=['stats'])
-async def _stats(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
-
-    stats = await engine.person_statistics(person.id)
+@command('stats')
+async def _stats(message: types.Message, state):
+    stats = await engine.person_statistics(state)
     await message.answer(stats.stat_string())
 
 
-@dp.message_handler(commands=['inventory'])
-async def _inventory(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
+@listing('inventory')
+async def _inventory(message: types.Message, state, cursor):
+    page = await engine.inventory_page(state, cursor)
+    return _page_message('Your inventory:\n', (cards.inventory_line(*entry) for entry in page.entries), page)
 
-    inventory = await engine.inventory(person.id)
-    result = 'Your inventory:\n'
-    for person_item in inventory:
-        result += f'id={person_item.item_id} type={person_item.item.item_type} qty={person_item.quantity} worn={person_item.put_on}\n'
-    await message.answer(result)
 
-
-@dp.message_handler(commands=['item_info'])
-async def _item_info(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
-
-    item_id = await _extract_item_id(message)
-    if not item_id:
-        return
-
-    person_item = await engine.get_person_item(person.id, item_id)
+@command('item_info', ITEM_ID)
+async def _item_info(message: types.Message, state, item_id):
+    person_item = await engine.get_person_item(state, item_id)
     if not person_item:
         await message.reply('Please, enter a correct item_id that you own.')
         return
-    item = person_item.item
-    await message.answer(f'Item info:\n{item_string(item)}')
-
+    await message.answer(f'Item info:\n{cards.item_card(person_item.item)}')
 
-@dp.message_handler(commands=['put_on'])
-async def _put_on(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
 
-    item_id = await _extract_item_id(message)
-    if not item_id:
-        return
-
-    err = await engine.put_on_item(person.id, item_id)
+@command('put_on', ITEM_ID)
+async def _put_on(message: types.Message, state, item_id):
+    err = await engine.put_on_item(state, item_id)
     if err:
         await message.reply(f"Can't put on the item, because {err}.")
     else:
         await message.answer('Successfully put on the item.')
 
 
-@dp.message_handler(commands=['take_off'])
-async def _take_off(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
-
-    item_id = await _extract_item_id(message)
-    if not item_id:
-        return
-
-    err = await engine.take_off_item(person.id, item_id)
+@command('take_off', ITEM_ID)
+async def _take_off(message: types.Message, state, item_id):
+    err = await engine.take_off_item(state, item_id)
     if err:
         await message.reply(f"Can't take off the item, because {err}.")
     else:
         await message.answer('Successfully put off the item.')
 
 
-@dp.message_handler(commands=['shop'])
-async def _shop(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
-
-    err, items = await engine.list_items_to_buy(person.id)
+@listing('shop')
+async def _shop(message: types.Message, state, cursor):
+    err, page = await engine.shop_page(state, cursor)
     if err:
         await message.reply(f"Can't shop here, because {err}")
         return
 
-    res = 'Available items:\n'
-    for item in items:
-        res += '–' * 15 + '\n'
-        res += item_string(item)
+    return _page_message('Available items:\n', (cards.SEPARATOR + cards.item_card(item) for item in page.entries), page)
 
-    await message.answer(res)
 
-
-@dp.message_handler(commands=['buy'])
-async def _buy(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
-
-    res = await _extract_item_id_and_quantity(message)
-    if not res:
-        return
-    item_id, quantity = res
-
-    err = await engine.buy_item(person.id, item_id, int(quantity))
+@command('buy', CommandSchema(
+    integer('item_id'), integer('quantity'), repeated=True, error='Please, enter correct pairs of item_id and quantity',
+))
+async def _buy(message: types.Message, state, cart):
+    err = await engine.buy_items(state, cart)
     if err:
-        await message.reply(f"Can't buy the item, because {err}")
+        await message.reply(f"Can't buy the items, because {err}")
     else:
-        await message.answer('Successfully bought the item. Check the inventory and statistics.')
-
-
-@dp.message_handler(commands=['sell'])
-async def _sell(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
+        await message.answer('Successfully bought the items. Check the inventory and statistics.')
 
-    res = await _extract_item_id_and_quantity(message)
-    if not res:
-        return
-    item_id, quantity = res
 
-    err = await engine.sell_item(person.id, item_id, int(quantity))
+@command('sell', CommandSchema(
+    integer('item_id'), integer('quantity'), error='Please, enter a correct item_id and quantity',
+))
+async def _sell(message: types.Message, state, item_id, quantity):
+    err = await engine.sell_item(state, item_id, quantity)
     if err:
         await message.reply(f"Can't sell the item, because {err}")
     else:
         await message.answer('Successfully sold the item. Check the inventory and statistics.')
 
 
-@dp.message_handler(commands=['available_destinations'])
-async def _available_destinations(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
-
-    paths = await engine.get_available_paths(person.id)
-    res = 'You can travel to:\n'
-    for path in paths:
-        res += '-' * 15 + '\n'
-        res += dedent(
-            f"""\
-            id: {path.to_location_id}
-            coordinates: {path.to_location.x_coord, path.to_location.y_coord}
-            type: {path.to_location.location_type}
-            distance: {path.distance}
-            """
-        )
-    await message.answer(res)
-
-
-@dp.message_handler(commands=['start_journey'])
-async def _start_journey(message: types.Message):
-    person = await _get_person_and_check_state_integrity(message)
-    if not person:
-        return
+@listing('available_destinations')
+async def _available_destinations(message: types.Message, state, cursor):
+    page = await engine.destinations_page(state, cursor)
+    return _page_message(
+        'You can travel to:\n', ('-' * 15 + '\n' + cards.destination_card(path) for path in page.entries), page,
+    )
 
-    match = re.search(f'{message.get_command()}\\s+([0-9]+)*\\s*', message.text, re.IGNORECASE)
-    if not match:
-        await message.reply('Please, enter a correct location_id where you want to go.')
-        return
-    location_id = match.group(1)
 
-    (has_err, res_str) = await engine.start_journey(person.id, location_id)
+@command('start_journey', LOCATION_ID)
+async def _start_journey(message: types.Message, state, location_id):
+    (has_err, res_str) = await engine.start_journey(state, location_id)
     if has_err:
         await message.reply(f"Can't go to this location, because {res_str}")
     else:
         await message.answer(f'Started the journey. Should arrive at {res_str}')
 
+
+@command('route', LOCATION_ID)
+async def _route(message: types.Message, state, location_id):
+    (has_err, res_str) = await engine.start_route(state, location_id)
+    if has_err:
+        await message.reply(f"Can't go to this location, because {res_str}")
+    else:
+        await message.answer(f'Started the route {res_str}')
@@ -0,0 +1,69 @@
+from typing import Dict, Iterable, Tuple
+
+from dto import Item, Location, Path
+
+MESSAGE_LIMIT = 4096
+SEPARATOR = '–' * 15 + '\n'
+
+# Items and locations only change when the world is reloaded, so their text is built once per id until then.
+_item_cards: Dict[int, str] = {}
+_location_cards: Dict[int, str] = {}
+
+
+def clear():
+    _item_cards.clear()
+    _location_cards.clear()
+
+
+def item_card(item: Item) -> str:
+    card = _item_cards.get(item.id)
+    if card is None:
+        card = _item_cards[item.id] = (
+            f'id: {item.id}\n'
+            f'cost: {item.cost}\n'
+            f'cost_to_sale: {item.cost_to_sale}\n'
+            f'item_type: {item.item_type}\n'
+            f'hp: {item.hp}\n'
+            f'mana: {item.mana}\n'
+            f'attack: {item.attack}\n'
+            f'magic_attack: {item.magic_attack}\n'
+            f'armour: {item.armour}\n'
+            f'magic_armour: {item.magic_armour}\n'
+        )
+    return card
+
+
+def location_card(location: Location) -> str:
+    card = _location_cards.get(location.id)
+    if card is None:
+        card = _location_cards[location.id] = (
+            f'id: {location.id}\n'
+            f'coordinates: {location.x_coord, location.y_coord}\n'
+            f'type: {location.location_type}\n'
+        )
+    return card
+
+
+def destination_card(path: Path) -> str:
+    return f'{location_card(path.to_location)}distance: {path.distance}\n'
+
+
+def inventory_line(item: Item, quantity, put_on) -> str:
+    return f'id={item.id} type={item.item_type} qty={quantity} worn={put_on}\n'
+
+
+def page_text(header: str, blocks: Iterable[str], limit=MESSAGE_LIMIT) -> Tuple[str, int]:
+    # A page is edited in place by its buttons, so it has to stay one message. Returns the text and the number of
+    # blocks in it: blocks that would cross the limit are left for the next page, Page.cut moves Next back to them.
+    # The first block is always shown, cut to the limit if it is longer, so paging never gets stuck.
+    text = header
+    shown = 0
+    for block in blocks:
+        if len(text) + len(block) > limit:
+            if not shown:
+                text = (text + block)[:limit]
+                shown = 1
+            break
+        text += block
+        shown += 1
+    return text, shown
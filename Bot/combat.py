@@ -0,0 +1,166 @@
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from dto import AttackType, Item, Mob, Person
+
+MAX_ROUNDS = 50
+ROUND_SECONDS = 2.0
+DAMAGE_SPREAD = 0.2
+GOLD_PER_XP = 2
+ROUND_BLOCK = 8
+CHUNK_SIZE = 100_000
+
+
+class Fighter:
+    def __init__(self, hp, attack, magic_attack, armour, magic_armour):
+        self.hp = hp
+        self.attack = attack
+        self.magic_attack = magic_attack
+        self.armour = armour
+        self.magic_armour = magic_armour
+
+    @classmethod
+    def from_person(cls, person: Person) -> 'Fighter':
+        return cls(
+            hp=person.hp + person.bonus_hp,
+            attack=person.attack + person.bonus_attack,
+            magic_attack=person.magic_attack + person.bonus_magic_attack,
+            armour=person.armour + person.bonus_armour,
+            magic_armour=person.magic_armour + person.bonus_magic_armour,
+        )
+
+    @classmethod
+    def from_items(cls, base: 'Fighter', items: Iterable[Item]) -> 'Fighter':
+        fighter = cls(base.hp, base.attack, base.magic_attack, base.armour, base.magic_armour)
+        for item in items:
+            fighter.hp += item.hp
+            fighter.attack += item.attack
+            fighter.magic_attack += item.magic_attack
+            fighter.armour += item.armour
+            fighter.magic_armour += item.magic_armour
+        return fighter
+
+
+class FightResult:
+    def __init__(self, won, rounds, hp_left, xp, gold):
+        self.won = won
+        self.rounds = rounds
+        self.hp_left = hp_left
+        self.xp = xp
+        self.gold = gold
+
+    @property
+    def seconds(self):
+        return self.rounds * ROUND_SECONDS
+
+
+def base_damage(attack, armour):
+    return np.maximum(np.asarray(attack) - np.asarray(armour), 1)
+
+
+def fighter_damage(fighter: Fighter, mob: Mob, attack_type) -> int:
+    if attack_type == AttackType.MAGICAL:
+        return int(base_damage(fighter.magic_attack, mob.magic_armour))
+    return int(base_damage(fighter.attack, mob.armour))
+
+
+def mob_damage(fighter: Fighter, mob: Mob) -> int:
+    armour = fighter.magic_armour if mob.attack_type == AttackType.MAGICAL else fighter.armour
+    return int(base_damage(mob.attack, armour))
+
+
+def resolve(hp, damage, mob_hp, mob_damage, rng: np.random.Generator, max_rounds=MAX_ROUNDS):
+    # Rounds are rolled ROUND_BLOCK at a time and only undecided fights go on to the next block.
+    # The fighter strikes first every round, so a kill in round r means the mob landed only r - 1 hits.
+    hp, damage, mob_hp, mob_damage = (np.asarray(x, dtype=np.int64) for x in (hp, damage, mob_hp, mob_damage))
+    n = len(hp)
+    won = np.zeros(n, dtype=bool)
+    rounds = np.full(n, max_rounds)
+    dealt = np.zeros(n, dtype=np.int64)
+    taken = np.zeros(n, dtype=np.int64)
+    active = np.arange(n)
+
+    for first_round in range(0, max_rounds, ROUND_BLOCK):
+        width = min(ROUND_BLOCK, max_rounds - first_round)
+        block_dealt = dealt[active, None] + _rolled(damage[active], width, rng).cumsum(axis=1)
+        block_taken = taken[active, None] + _rolled(mob_damage[active], width, rng).cumsum(axis=1)
+        kill_round = _first_round(block_dealt >= mob_hp[active, None])
+        death_round = _first_round(block_taken >= hp[active, None])
+
+        block_won = kill_round <= np.minimum(death_round, width)
+        done = block_won | (death_round <= width)
+        finished = active[done]
+        won[finished] = block_won[done]
+        rounds[finished] = first_round + np.minimum(kill_round, death_round)[done]
+        hits = np.minimum(kill_round, death_round)[done] - block_won[done]
+        taken[finished] = np.where(
+            hits > 0, block_taken[done][np.arange(len(finished)), np.maximum(hits - 1, 0)], taken[finished],
+        )
+
+        active = active[~done]
+        dealt[active] = block_dealt[~done, -1]
+        taken[active] = block_taken[~done, -1]
+        if not len(active):
+            break
+
+    return won, rounds, np.maximum(hp - taken, 0)
+
+
+def fight(fighter: Fighter, mob: Mob, attack_type, rng: Optional[np.random.Generator] = None) -> FightResult:
+    won, rounds, hp_left = resolve(
+        [fighter.hp], [fighter_damage(fighter, mob, attack_type)], [mob.hp], [mob_damage(fighter, mob)],
+        rng or np.random.default_rng(),
+    )
+    won = bool(won[0])
+    return FightResult(
+        won=won,
+        rounds=int(rounds[0]),
+        hp_left=int(hp_left[0]),
+        xp=mob.xp if won else 0,
+        gold=mob.xp * GOLD_PER_XP if won else 0,
+    )
+
+
+class SimulationReport:
+    def __init__(self, win_rate, time_to_kill, xp_per_minute, gold_per_minute):
+        self.win_rate = win_rate
+        self.time_to_kill = time_to_kill
+        self.xp_per_minute = xp_per_minute
+        self.gold_per_minute = gold_per_minute
+
+
+def simulate(scenarios: List[Tuple[Fighter, Mob, str]], fights, rng: np.random.Generator) -> SimulationReport:
+    # Every scenario is repeated `fights` times and the flattened batch is resolved in chunks of CHUNK_SIZE fights.
+    hp = np.array([fighter.hp for fighter, _, _ in scenarios], dtype=np.int64)
+    damage = np.array([fighter_damage(fighter, mob, attack_type) for fighter, mob, attack_type in scenarios])
+    mob_hp = np.array([mob.hp for _, mob, _ in scenarios], dtype=np.int64)
+    received = np.array([mob_damage(fighter, mob) for fighter, mob, _ in scenarios])
+    xp = np.array([mob.xp for _, mob, _ in scenarios], dtype=np.float64)
+
+    n = len(scenarios)
+    wins, rounds, won_rounds = np.zeros(n), np.zeros(n), np.zeros(n)
+    for start in range(0, n * fights, CHUNK_SIZE):
+        index = np.arange(start, min(start + CHUNK_SIZE, n * fights)) // fights
+        chunk_won, chunk_rounds, _ = resolve(hp[index], damage[index], mob_hp[index], received[index], rng)
+        wins += np.bincount(index, chunk_won, minlength=n)
+        rounds += np.bincount(index, chunk_rounds, minlength=n)
+        won_rounds += np.bincount(index, chunk_rounds * chunk_won, minlength=n)
+
+    minutes = rounds * ROUND_SECONDS / 60
+    return SimulationReport(
+        win_rate=wins / fights,
+        time_to_kill=np.where(wins > 0, won_rounds * ROUND_SECONDS / np.maximum(wins, 1), np.nan),
+        xp_per_minute=wins * xp / minutes,
+        gold_per_minute=wins * xp * GOLD_PER_XP / minutes,
+    )
+
+
+def _rolled(damage, width, rng: np.random.Generator):
+    rolls = rng.uniform(1 - DAMAGE_SPREAD, 1 + DAMAGE_SPREAD, (len(damage), width))
+    return np.maximum(np.rint(damage[:, None] * rolls), 1).astype(np.int64)
+
+
+def _first_round(mask):
+    # 1-based index of the first True in every row, the row width + 1 when there is none.
+    return np.where(mask.any(axis=1), mask.argmax(axis=1) + 1, mask.shape[1] + 1)
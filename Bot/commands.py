@@ -0,0 +1,47 @@
+import re
+from typing import List, Optional, Tuple
+
+
+class Argument:
+    def __init__(self, name, pattern, convert):
+        self.name = name
+        self.pattern = pattern
+        self.convert = convert
+
+
+def integer(name) -> Argument:
+    return Argument(name, '[0-9]+', int)
+
+
+def word(name) -> Argument:
+    return Argument(name, '[a-z0-9]+', str)
+
+
+class CommandSchema:
+    # Arguments of a command: a fixed sequence, or with repeated=True one or more such sequences that are handed
+    # to the handler as a single list of tuples. Patterns are compiled once, when the handler is registered.
+    def __init__(self, *arguments: Argument, repeated=False, error=None):
+        self.arguments = arguments
+        self.repeated = repeated
+        self.error = error
+        groups = '\\s+'.join(f'({argument.pattern})' for argument in arguments)
+        if repeated:
+            self._item = re.compile(groups, re.IGNORECASE)
+            # Repetitions are separated by whitespace too, so run-together or odd-count values never match.
+            self._pattern = re.compile(f'\\s*{groups}(?:\\s+{groups})*\\s*', re.IGNORECASE)
+        else:
+            self._pattern = re.compile(f'\\s*{groups}\\s*' if arguments else '\\s*', re.IGNORECASE)
+
+    def parse(self, text) -> Optional[Tuple]:
+        text = text or ''
+        match = self._pattern.fullmatch(text)
+        if not match:
+            return None
+        if self.repeated:
+            return self._convert_all(self._item.findall(text)),
+        return tuple(argument.convert(value) for argument, value in zip(self.arguments, match.groups()))
+
+    def _convert_all(self, found) -> List[Tuple]:
+        if len(self.arguments) == 1:
+            found = [(value,) for value in found]
+        return [tuple(argument.convert(value) for argument, value in zip(self.arguments, values)) for values in found]
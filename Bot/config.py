@@ -0,0 +1,57 @@
+import os
+
+BOT_TOKEN = os.environ.get('BOT_TOKEN', '')
+GAME_DATABASE = os.environ.get('GAME_DATABASE', 'game.db')
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 1))
+SHARD_DATABASE = os.environ.get('SHARD_DATABASE', '')
+
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', 8888))
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', 32))
+WEBHOOK_MAX_PENDING = int(os.environ.get('WEBHOOK_MAX_PENDING', 256))
+WEBHOOK_RETRY_AFTER = int(os.environ.get('WEBHOOK_RETRY_AFTER', 1))
+
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 10))
+
+MAILBOX_MAX_DEPTH = int(os.environ.get('MAILBOX_MAX_DEPTH', 8))
+
+THROTTLE_USER_RATE = float(os.environ.get('THROTTLE_USER_RATE', 1))
+THROTTLE_USER_BURST = float(os.environ.get('THROTTLE_USER_BURST', 5))
+THROTTLE_GLOBAL_RATE = float(os.environ.get('THROTTLE_GLOBAL_RATE', 200))
+THROTTLE_GLOBAL_BURST = float(os.environ.get('THROTTLE_GLOBAL_BURST', 400))
+THROTTLE_COSTS = os.environ.get('THROTTLE_COSTS', 'start=0.2,help=0.2,shop=2,available_destinations=2,route=2,buy=1.5')
+
+PLAYER_CACHE_SIZE = int(os.environ.get('PLAYER_CACHE_SIZE', 10000))
+PLAYER_CACHE_FLUSH_SECONDS = float(os.environ.get('PLAYER_CACHE_FLUSH_SECONDS', 1))
+PLAYER_CACHE_MAX_DIRTY = int(os.environ.get('PLAYER_CACHE_MAX_DIRTY', 1000))
+PLAYER_CACHE_JOURNAL = os.environ.get('PLAYER_CACHE_JOURNAL', '')
+PLAYER_CACHE_FSYNC = os.environ.get('PLAYER_CACHE_FSYNC', '0') == '1'
+
+WARM_UP = os.environ.get('WARM_UP', '1') == '1'
+
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64 * 1024))
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+SQLITE_READ_POOL_SIZE = int(os.environ.get('SQLITE_READ_POOL_SIZE', 4))
+
+JOURNEY_TICK_SECONDS = float(os.environ.get('JOURNEY_TICK_SECONDS', 0.5))
+JOURNEY_COMPACTION_INTERVAL_SECONDS = float(os.environ.get('JOURNEY_COMPACTION_INTERVAL_SECONDS', 60))
+JOURNEY_COMPACTION_BATCH_SIZE = int(os.environ.get('JOURNEY_COMPACTION_BATCH_SIZE', 500))
+JOURNEY_ROLLUP_AFTER_SECONDS = float(os.environ.get('JOURNEY_ROLLUP_AFTER_SECONDS', 0))
+
+ROUTE_MAX_DENSE_LOCATIONS = int(os.environ.get('ROUTE_MAX_DENSE_LOCATIONS', 1000))
+ROUTE_CACHE_SIZE = int(os.environ.get('ROUTE_CACHE_SIZE', 1024))
+ROUTE_SEARCH_WORKERS = int(os.environ.get('ROUTE_SEARCH_WORKERS', 1))
+ROUTE_MAX_SEARCHES = int(os.environ.get('ROUTE_MAX_SEARCHES', 16))
+ROUTE_SEARCH_TIMEOUT = float(os.environ.get('ROUTE_SEARCH_TIMEOUT', 5))
+
+WORLD_PATHS = os.environ.get('WORLD_PATHS', 'auto')
+PATH_MAX_DISTANCE = int(os.environ.get('PATH_MAX_DISTANCE', 10))
+
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9464))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, MetaData, ForeignKey, Boolean, Float
+from sqlalchemy import Column, Integer, String, MetaData, ForeignKey, Boolean, Float, Index
 from sqlalchemy.orm import declarative_base, relationship
 
 meta = MetaData()
@@ -27,7 +27,10 @@ class Location(Base):
 
 class Person(Base):
     __tablename__ = 'person'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index('ix_person_external_id_id', 'external_id', 'id'),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True)
     nickname = Column(String(length=256))
@@ -44,6 +47,13 @@ class Person(Base):
     location_id = Column(Integer, ForeignKey('location.id'))
     location = relationship(Location.__name__, foreign_keys='Person.location_id')
 
+    bonus_hp = Column(Integer, nullable=False, default=0, server_default='0')
+    bonus_mana = Column(Integer, nullable=False, default=0, server_default='0')
+    bonus_attack = Column(Integer, nullable=False, default=0, server_default='0')
+    bonus_magic_attack = Column(Integer, nullable=False, default=0, server_default='0')
+    bonus_armour = Column(Integer, nullable=False, default=0, server_default='0')
+    bonus_magic_armour = Column(Integer, nullable=False, default=0, server_default='0')
+
 
 class AttackType:
     PHYSICAL = 'physical'
@@ -87,6 +97,9 @@ class ItemType:
     }
 
 
+ITEM_BONUS_PROPERTIES = ('hp', 'mana', 'attack', 'magic_attack', 'armour', 'magic_armour')
+
+
 class Item(Base):
     __tablename__ = 'item'
     __table_args__ = {'extend_existing': True}
@@ -106,7 +119,10 @@ class Item(Base):
 
 class PersonItem(Base):
     __tablename__ = 'person_item'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index('ux_person_item_person_id_item_id', 'person_id', 'item_id', unique=True),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -122,7 +138,10 @@ class PersonItem(Base):
 
 class Path(Base):
     __tablename__ = 'path'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index('ux_path_from_location_id_to_location_id', 'from_location_id', 'to_location_id', unique=True),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -137,7 +156,10 @@ class Path(Base):
 
 class ItemInLocation(Base):
     __tablename__ = 'item_in_location'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index('ux_item_in_location_location_id_item_id', 'location_id', 'item_id', unique=True),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -150,7 +172,10 @@ class ItemInLocation(Base):
 
 class Journey(Base):
     __tablename__ = 'journey'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index('ix_journey_person_id_arrive_by', 'person_id', 'arrive_by'),
+        {'extend_existing': True},
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -163,4 +188,42 @@ class Journey(Base):
     to_location_id = Column(Integer, ForeignKey('location.id'))
     to_location = relationship(Location.__name__, foreign_keys='Journey.to_location_id')
 
+    departed_at = Column(Float)
+    arrive_by = Column(Float)
+
+
+class ActiveJourney(Base):
+    __tablename__ = 'active_journey'
+    __table_args__ = (
+        Index('ix_active_journey_arrived_arrive_by', 'arrived', 'arrive_by'),
+        {'extend_existing': True},
+    )
+
+    person_id = Column(Integer, ForeignKey('person.id'), primary_key=True)
+    person = relationship(Person.__name__, foreign_keys='ActiveJourney.person_id')
+
+    from_location_id = Column(Integer, ForeignKey('location.id'))
+    from_location = relationship(Location.__name__, foreign_keys='ActiveJourney.from_location_id')
+
+    to_location_id = Column(Integer, ForeignKey('location.id'))
+    to_location = relationship(Location.__name__, foreign_keys='ActiveJourney.to_location_id')
+
+    departed_at = Column(Float)
     arrive_by = Column(Float)
+    remaining_route = Column(String)
+    arrived = Column(Boolean, nullable=False, default=False, server_default='0')
+
+
+class TravelStatistics(Base):
+    __tablename__ = 'travel_statistics'
+    __table_args__ = {'extend_existing': True}
+
+    person_id = Column(Integer, ForeignKey('person.id'), primary_key=True)
+    person = relationship(Person.__name__, foreign_keys='TravelStatistics.person_id')
+
+    journeys = Column(Integer)
+    travel_time = Column(Float)
+
+
+WORLD_TABLES = [table.__table__ for table in (Location, Mob, Item, Path, ItemInLocation)]
+PLAYER_TABLES = [table.__table__ for table in (Person, PersonItem, Journey, ActiveJourney, TravelStatistics)]
@@ -1,20 +1,40 @@
-from functools import reduce
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import List, Optional, Tuple
 from textwrap import dedent
 from time import time
 from datetime import datetime
 
-from dto import Person, Item, ItemType, PersonItem, Path, LocationType, Journey
+from dto import Person, Item, ItemType, PersonItem, LocationType, ActiveJourney, Location, ITEM_BONUS_PROPERTIES
+import cards
+import config
+import metrics
 from game_dao import GameAsyncDao
+from journey_compaction import JourneyCompactor
+from journey_scheduler import Arrival, JourneyScheduler, format_route
+from paging import Cursor, Page, page_of_rows, page_of_sorted
+from player_cache import PlayerCache
+from records import OwnedItem, PersonRecord
+from route_engine import RouteEngine
+from world_catalog import WorldCatalog
 
 
-class PersonStatistics:
-    def __init__(self, person: Person, worn_items: List[Item]):
+_touched_players: ContextVar[Optional[List[str]]] = ContextVar('touched_players', default=None)
+_applied_arrivals: ContextVar[Optional[List[Arrival]]] = ContextVar('applied_arrivals', default=None)
+
+
+class PlayerState:
+    def __init__(self, person: PersonRecord, location: Location):
         self.person = person
-        self.worn_items = worn_items
+        self.location = location
 
-    def compute_worn_by_property(self, property_getter):
-        return reduce(lambda x, y: x + property_getter(y), self.worn_items, 0)
+
+class PersonStatistics:
+    def __init__(self, person: PersonRecord, location: Location):
+        self.person = person
+        self.location = location
 
     def stat_string(self):
         return dedent(
@@ -25,21 +45,76 @@ class PersonStatistics:
             * HP: {self.person.hp}
             * XP: {self.person.xp}
             * Money: {self.person.money}
-            * Attack: {self.person.attack} (+{self.compute_worn_by_property(lambda x: x.attack)})
-            * Magic attack: {self.person.magic_attack} (+{self.compute_worn_by_property(lambda x: x.magic_attack)})
-            * Armour: {self.person.armour} (+{self.compute_worn_by_property(lambda x: x.armour)})
-            * Magic armour: {self.person.magic_armour} (+{self.compute_worn_by_property(lambda x: x.magic_armour)})
-            * Location: {self.person.location.x_coord, self.person.location.y_coord}
+            * Attack: {self.person.attack} (+{self.person.bonus_attack})
+            * Magic attack: {self.person.magic_attack} (+{self.person.bonus_magic_attack})
+            * Armour: {self.person.armour} (+{self.person.bonus_armour})
+            * Magic armour: {self.person.magic_armour} (+{self.person.bonus_magic_armour})
+            * Location: {self.location.x_coord, self.location.y_coord}
             """
         )
 
 
+@metrics.timed_methods(metrics.ENGINE_SECONDS)
 class GameAsyncEngine:
     def __init__(self):
         self.dao = GameAsyncDao()
-
-    async def init_person(self, nickname, external_id) -> Person:
-        location = await self.dao.get_first_location()
+        self.world = WorldCatalog()
+        self.routes = RouteEngine()
+        self.players = PlayerCache(self.dao)
+        self.scheduler = JourneyScheduler(self.dao, self.world, self.players)
+        self.compactor = JourneyCompactor(self.dao)
+
+    async def start(self):
+        await self.dao.migrate()
+        if config.WARM_UP:
+            await self.dao.warm_up()
+        await self.reload_world()
+        await self.players.start()
+        await self.scheduler.start()
+        self.compactor.start()
+
+    async def reload_world(self):
+        await self.world.load(self.dao)
+        cards.clear()
+        self.routes.build(self.world.locations.keys(), *self.world.edges())
+
+    async def stop(self):
+        await self.compactor.stop()
+        await self.scheduler.stop()
+        await self.players.stop()
+        self.routes.close()
+        await self.dao.dispose()
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        # Cached persons are changed before the commit. If the update fails, they are dropped and read again, and
+        # the journeys it applied are scheduled again.
+        touched = []
+        arrivals = []
+        token = _touched_players.set(touched)
+        arrivals_token = _applied_arrivals.set(arrivals)
+        try:
+            async with self.dao.unit_of_work() as unit_of_work:
+                yield unit_of_work
+        except BaseException:
+            for external_id in touched:
+                self.players.invalidate(external_id)
+            self.scheduler.restore(arrivals)
+            raise
+        finally:
+            _applied_arrivals.reset(arrivals_token)
+            _touched_players.reset(token)
+
+    async def commit(self):
+        # Committed work is final: a later failure of the update only rolls back and restores what came after.
+        await self.dao.commit()
+        for pending in (_touched_players.get(), _applied_arrivals.get()):
+            if pending is not None:
+                pending.clear()
+
+    async def init_person(self, nickname, external_id) -> PersonRecord:
+        location = self.world.first_location
+        item = self.world.first_weapon
         person = await self.dao.create_and_get(
             Person(
                 nickname=nickname,
@@ -54,10 +129,10 @@ class GameAsyncEngine:
                 armour=0,
                 magic_armour=0,
                 location_id=location.id,
+                **{f'bonus_{name}': getattr(item, name) for name in ITEM_BONUS_PROPERTIES},
             )
         )
 
-        item = await self.dao.get_first_weapon()
         await self.dao.create_and_get(
             PersonItem(
                 person_id=person.id,
@@ -66,126 +141,192 @@ class GameAsyncEngine:
                 put_on=True,
             )
         )
-        return person
-
-    async def get_person(self, external_id) -> Person:
-        return await self.dao.get_person_by_external_id(external_id)
-
-    async def person_statistics(self, person_id) -> PersonStatistics:
-        person = await self.dao.get_by_id(Person, person_id, references=[Person.location])
-        worn_items = self._unwrap_items(await self.dao.get_items(person.id, only_worn=True))
-        return PersonStatistics(person, worn_items)
-
-    async def inventory(self, person_id) -> List[PersonItem]:
-        return await self.dao.get_items(person_id)
-
-    async def get_person_item(self, person_id, item_id) -> PersonItem:
-        return await self.dao.get_person_item(person_id, item_id)
-
-    async def put_on_item(self, person_id, item_id) -> Optional[str]:
-        person_item = await self.dao.get_person_item(person_id, item_id)
+        self._touch(external_id)
+        return self.players.put(PersonRecord.of(person))
+
+    async def get_player_state(self, external_id) -> Optional[PlayerState]:
+        person = self.players.get(external_id)
+        if person is None:
+            person = await self.dao.get_player(external_id)
+            if person is None:
+                return None
+            person = self.players.put(person)
+        self._touch(external_id)
+        return PlayerState(person, self.world.location(person.location_id))
+
+    async def person_statistics(self, state: PlayerState) -> PersonStatistics:
+        return PersonStatistics(state.person, state.location)
+
+    async def inventory_page(self, state: PlayerState, cursor: Optional[Cursor] = None, size=config.PAGE_SIZE) -> Page:
+        # Entries are (item, quantity, put_on) ordered by item id.
+        rows = await self.dao.get_items_page(state.person.id, cursor, size + 1)
+        page = page_of_rows(rows, cursor, size, key=lambda row: row.item_id)
+        if not page.entries and cursor is not None:
+            # The items of that page were sold in the meantime.
+            return await self.inventory_page(state, None, size)
+        page.entries = [(self.world.item(row.item_id), row.quantity, row.put_on) for row in page.entries]
+        return page
+
+    async def get_person_item(self, state: PlayerState, item_id) -> Optional[OwnedItem]:
+        return self._owned(await self.dao.get_person_item(state.person.id, item_id))
+
+    async def put_on_item(self, state: PlayerState, item_id) -> Optional[str]:
+        person_id = state.person.id
+        person_item = self._owned(await self.dao.get_person_item(person_id, item_id))
         if not person_item:
             return 'no such item exists'
         elif person_item.put_on:
             return 'item is already worn'
 
         if person_item.item.item_type != ItemType.POTION:
-            worn_items = self._unwrap_items(await self.dao.get_items(person_id, only_worn=True))
+            worn_items = [self.world.item(row.item_id) for row in await self.dao.get_items(person_id, only_worn=True)]
             items_with_current_type = list(filter(lambda x: x.item_type == person_item.item.item_type, worn_items))
             assert len(items_with_current_type) <= 1
             if len(items_with_current_type) == 1:
-                await self.take_off_item(person_id, item_id=items_with_current_type[0].id)
+                await self.take_off_item(state, item_id=items_with_current_type[0].id)
 
-        await self.dao.update_person_item_put_on(person_item.id, put_on=True)
+        if not await self.dao.set_item_put_on(person_id, person_item.item, put_on=True):
+            return 'item is already worn'
+        self._add_bonuses(state.person, person_item.item, 1)
 
-    async def take_off_item(self, person_id, item_id) -> Optional[str]:
-        person_item = await self.dao.get_person_item(person_id, item_id)
+    async def take_off_item(self, state: PlayerState, item_id) -> Optional[str]:
+        person_item = self._owned(await self.dao.get_person_item(state.person.id, item_id))
         if not person_item:
             return 'no such item exists'
         elif not person_item.put_on:
             return 'item is not worn'
 
-        await self.dao.update_person_item_put_on(person_item.id, put_on=False)
-
-    async def list_items_to_buy(self, person_id) -> Tuple[Optional[str], List[Item]]:
-        person = await self.dao.get_by_id(Person, person_id, references=[Person.location])
-        if person.location.location_type == LocationType.DUNGEON:
-            return f'there are no shops in {LocationType.DUNGEON}', []
-        return None, await self.dao.get_all_items_in_location(person.location_id, person.level)
-
-    async def buy_item(self, person_id, item_id, quantity) -> Optional[str]:
-        person = await self.dao.get_by_id(Person, person_id, references=[Person.location])
-        if person.location.location_type == LocationType.DUNGEON:
+        if not await self.dao.set_item_put_on(state.person.id, person_item.item, put_on=False):
+            return 'item is not worn'
+        self._add_bonuses(state.person, person_item.item, -1)
+
+    async def shop_page(self, state: PlayerState, cursor: Optional[Cursor] = None,
+                        size=config.PAGE_SIZE) -> Tuple[Optional[str], Optional[Page]]:
+        if state.location.location_type == LocationType.DUNGEON:
+            return f'there are no shops in {LocationType.DUNGEON}', None
+        items = self.world.items_in_location(state.location.id, state.person.level)
+        return None, page_of_sorted(items, cursor, size, key=lambda item: item.id)
+
+    async def buy_items(self, state: PlayerState, cart: List[Tuple[int, int]]) -> Optional[str]:
+        person = state.person
+        if state.location.location_type == LocationType.DUNGEON:
             return f'there are no shops in {LocationType.DUNGEON}'
 
-        item_in_location = await self.dao.get_item_in_location(item_id, person.location_id)
-        if not item_in_location or person.level < item_in_location.item.req_level:
-            return 'no such item in this location'
-
-        buy_amount = quantity * item_in_location.item.cost
-        if buy_amount > person.money:
+        quantities = defaultdict(int)
+        for item_id, quantity in cart:
+            item = self.world.item_in_location(item_id, state.location.id)
+            if not item or person.level < item.req_level:
+                return 'no such item in this location'
+            elif quantity <= 0:
+                return 'quantity should be positive'
+            quantities[item.id] += quantity
+
+        buy_amount = sum(quantity * self.world.item(item_id).cost for item_id, quantity in quantities.items())
+        if buy_amount > person.money or not await self.dao.buy_items(person.id, buy_amount, quantities):
             return 'insufficient funds'
+        person.money -= buy_amount
 
-        await self.dao.perform_transaction(
-            person_id=person_id,
-            balance_change=-buy_amount,
-            item_id=item_id,
-            quantity_change=quantity,
-        )
-
-    async def sell_item(self, person_id, item_id, quantity) -> Optional[str]:
-        person = await self.dao.get_by_id(Person, person_id, references=[Person.location])
-        if person.location.location_type == LocationType.DUNGEON:
+    async def sell_item(self, state: PlayerState, item_id, quantity) -> Optional[str]:
+        person = state.person
+        if state.location.location_type == LocationType.DUNGEON:
             return f'there are no shops in {LocationType.DUNGEON}'
 
-        person_item = await self.dao.get_person_item(person_id, item_id)
-        if not person_item:
+        item = self.world.item(item_id)
+        if not item:
             return 'no such item exist'
-        elif quantity > person_item.quantity:
+        elif quantity <= 0:
+            return 'quantity should be positive'
+
+        gain = quantity * item.cost_to_sale
+        sold, taken_off = await self.dao.sell_item(person.id, item, quantity, gain)
+        if not sold:
+            if not await self.dao.get_person_item(person.id, item.id):
+                return 'no such item exist'
             return "don't have so many items"
+        person.money += gain
+        if taken_off:
+            self._add_bonuses(person, item, -1)
 
-        await self.dao.perform_transaction(
-            person_id=person_id,
-            balance_change=quantity * person_item.item.cost_to_sale,
-            item_id=item_id,
-            quantity_change=-quantity,
-        )
-
-    async def get_available_paths(self, person_id) -> List[Path]:
-        person = await self.dao.get_by_id(Person, person_id)
-        return await self.dao.get_available_paths(person.location_id)
+    async def destinations_page(self, state: PlayerState, cursor: Optional[Cursor] = None, size=config.PAGE_SIZE) -> Page:
+        paths = sorted(self.world.paths_from(state.location.id), key=lambda path: path.to_location_id)
+        return page_of_sorted(paths, cursor, size, key=lambda path: path.to_location_id)
 
-    async def start_journey(self, person_id, to_location_id) -> Tuple[bool, str]:
-        person = await self.dao.get_by_id(Person, person_id)
-        path = await self.dao.get_path_by_from_and_to_points(person.location_id, to_location_id)
+    async def start_journey(self, state: PlayerState, to_location_id) -> Tuple[bool, str]:
+        path = self.world.path(state.location.id, to_location_id)
         if not path:
             return True, "desired location can't be reached from here"
 
-        journey = await self.dao.create_and_get(
-            Journey(
-                person_id=person_id,
-                from_location_id=path.from_location_id,
-                to_location_id=path.to_location_id,
-                arrive_by=time() + path.distance,
-            )
+        departed_at = time()
+        journey = ActiveJourney(
+            person_id=state.person.id,
+            from_location_id=path.from_location_id,
+            to_location_id=path.to_location_id,
+            departed_at=departed_at,
+            arrive_by=departed_at + path.distance,
         )
+        await self.dao.start_journey(journey)
+        self.scheduler.schedule(journey)
         return False, str(datetime.fromtimestamp(journey.arrive_by))
 
-    async def check_journey_and_update_person(self, person_id) -> Optional[str]:
-        journey = await self.dao.get_last_journey(person_id)
-        if not journey:
+    async def start_route(self, state: PlayerState, to_location_id) -> Tuple[bool, str]:
+        try:
+            route = await self.routes.route(state.location.id, to_location_id)
+        except asyncio.TimeoutError:
+            return True, 'the route is still being planned, please try again in a few seconds'
+        if not route:
+            return True, "desired location can't be reached"
+        elif len(route) == 1:
+            return True, 'you are already there'
+
+        path = self.world.path(route[0], route[1])
+        departed_at = time()
+        journey = ActiveJourney(
+            person_id=state.person.id,
+            from_location_id=path.from_location_id,
+            to_location_id=path.to_location_id,
+            departed_at=departed_at,
+            arrive_by=departed_at + path.distance,
+            remaining_route=format_route(route[2:]),
+        )
+        await self.dao.start_journey(journey)
+        self.scheduler.schedule(journey)
+        arrive_by = self.scheduler.traveling_until[state.person.id]
+        return False, f"{' -> '.join(map(str, route))}. Should arrive at {datetime.fromtimestamp(arrive_by)}"
+
+    async def check_journey_and_update_person(self, state: PlayerState) -> Optional[str]:
+        person = state.person
+        arrive_by = self.scheduler.traveling_until.get(person.id)
+        if arrive_by is None:
             return
-        elif journey.arrive_by > time():
-            return f'In journey. Should arrive by {datetime.fromtimestamp(journey.arrive_by)}'
-
-        person = await self.dao.get_by_id(Person, person_id)
-        if person.location_id == journey.from_location_id:
-            await self.dao.update_person_location_and_state(
-                person_id=person_id,
-                new_location_id=journey.to_location_id,
-                hp=100 if journey.to_location.location_type == LocationType.TOWN else person.hp,
-            )
+        elif arrive_by > time():
+            return f'In journey. Should arrive by {datetime.fromtimestamp(arrive_by)}'
+
+        # Every due leg of a route is applied, the background task may be behind. An arrival in flight there has
+        # already moved the cached person.
+        now = time()
+        while True:
+            arrival = await self.scheduler.apply_arrival(person.id, now)
+            if arrival is None:
+                break
+            applied = _applied_arrivals.get()
+            if applied is not None:
+                applied.append(arrival)
+            if person.location_id == arrival.from_location_id:
+                person.location_id = arrival.to_location_id
+                if arrival.restores_hp:
+                    person.hp = 100
+        state.location = self.world.location(person.location_id)
+
+    @staticmethod
+    def _touch(external_id):
+        touched = _touched_players.get()
+        if touched is not None:
+            touched.append(external_id)
+
+    def _owned(self, row) -> Optional[OwnedItem]:
+        return OwnedItem(self.world.item(row.item_id), row.quantity, row.put_on) if row is not None else None
 
     @staticmethod
-    def _unwrap_items(person_items) -> List[Item]:
-        return list(map(lambda x: x.item, person_items))
+    def _add_bonuses(person: PersonRecord, item: Item, sign):
+        for name in ITEM_BONUS_PROPERTIES:
+            setattr(person, f'bonus_{name}', getattr(person, f'bonus_{name}') + sign * getattr(item, name))
@@ -1,199 +1,378 @@
-from typing import TypeVar, List
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import TypeVar, List, Tuple, Optional, Dict
 
-from sqlalchemy import and_, or_, desc, update, delete
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import Row
 from sqlalchemy.future import select
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm import selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import configure_mappers, selectinload
 
-from dto import Location, Item, PersonItem, ItemType, Person, ItemInLocation, Path, Journey
+from dto import Location, Item, Mob, Person, ItemInLocation, Path, Journey, ActiveJourney, TravelStatistics, \
+    ITEM_BONUS_PROPERTIES, PLAYER_TABLES, WORLD_TABLES
+import config
+import metrics
 from init_db import database_name
+from migrate_db import migrate
+from paging import Cursor
+from records import PersonRecord
+from sharding import next_person_id, shard_databases, shard_of_person, shard_of_player
+import statements
+from storage import SqliteStore, StorageProfile
+
+
+class UnitOfWork:
+    # Sessions are opened per store on first use. An update of one player touches only that player's shard; the
+    # background jobs that go over every shard commit each shard on its own.
+    def __init__(self):
+        self.read_sessions: Dict[SqliteStore, AsyncSession] = {}
+        self.write_sessions: Dict[SqliteStore, AsyncSession] = {}
+
+    def session(self, store: SqliteStore, write) -> AsyncSession:
+        if write or store in self.write_sessions:
+            if store not in self.write_sessions:
+                self.write_sessions[store] = store.WriteSession()
+            return self.write_sessions[store]
+
+        if store not in self.read_sessions:
+            self.read_sessions[store] = store.ReadSession()
+        return self.read_sessions[store]
+
+    async def commit(self):
+        for session in self.write_sessions.values():
+            with metrics.COMMIT_SECONDS.time():
+                await session.commit()
+        await self.close()
+
+    async def close(self):
+        for session in (*self.read_sessions.values(), *self.write_sessions.values()):
+            await session.close()
+        self.read_sessions = {}
+        self.write_sessions = {}
+
+
+_current_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar('current_unit_of_work', default=None)
 
 
 class GameAsyncDao:
     T = TypeVar("T")
 
-    def __init__(self):
-        self.engine = create_async_engine(f'sqlite+aiosqlite:///{database_name}', echo=False)
-        self.AsyncSession = sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+    def __init__(self, profile: Optional[StorageProfile] = None, shard_count=config.SHARD_COUNT):
+        # Static world tables stay in game.db. With more than one shard, player tables are split by player
+        # across shard files that attach game.db, otherwise game.db holds everything.
+        self.world_store = SqliteStore(database_name, profile)
+        if shard_count > 1:
+            self.shards = [
+                SqliteStore(shard_database, profile, attach=database_name, name=f'shard{shard}')
+                for shard, shard_database in enumerate(shard_databases(database_name, shard_count))
+            ]
+        else:
+            self.shards = [self.world_store]
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        unit_of_work = _current_unit_of_work.get()
+        if unit_of_work is not None:
+            yield unit_of_work
+            return
+
+        unit_of_work = UnitOfWork()
+        token = _current_unit_of_work.set(unit_of_work)
+        try:
+            yield unit_of_work
+            await unit_of_work.commit()
+        finally:
+            _current_unit_of_work.reset(token)
+            await unit_of_work.close()
+
+    async def commit(self):
+        unit_of_work = _current_unit_of_work.get()
+        if unit_of_work is not None:
+            await unit_of_work.commit()
 
     async def create_and_get(self, entry):
-        async with self._new_session() as s:
+        if isinstance(entry, Person):
+            shard = shard_of_player(entry.external_id, len(self.shards))
+        else:
+            shard = shard_of_person(entry.person_id, len(self.shards))
+        async with self._session(write=True, store=self.shards[shard]) as s:
+            if isinstance(entry, Person) and len(self.shards) > 1 and entry.id is None:
+                max_id = (await s.execute(select(func.max(Person.id)))).scalar()
+                entry.id = next_person_id(max_id, shard, len(self.shards))
             await self._create_and_get(s, entry)
         return entry
 
     async def get_by_id(self, table: T, id, references=[]) -> T:
-        async with self._new_session() as s:
+        async with self._session(write=False, store=self._table_store(table, id)) as s:
             query = select(table).where(table.id == id)
             for reference in references:
                 query = query.options(selectinload(reference))
             return (await s.execute(query)).scalar()
 
-    async def get_person_by_external_id(self, external_id):
-        async with self._new_session() as s:
-            query = select(Person)\
-                .where(Person.external_id == external_id)\
-                .order_by(desc(Person.id))\
-                .limit(1)
-            return (await s.execute(query)).scalar()
+    async def get_player(self, external_id) -> Optional[PersonRecord]:
+        # The latest person of a player, their location comes from WorldCatalog.
+        async with self._session(write=False, store=self._player_store(external_id)) as s:
+            row = (await s.execute(statements.PLAYER, dict(external_id=external_id))).first()
+            return PersonRecord(*row) if row is not None else None
+
+    async def get_pending_journeys(self) -> List[ActiveJourney]:
+        journeys = []
+        for store in self.shards:
+            async with self._session(write=False, store=store) as s:
+                journeys.extend((await s.execute(statements.PENDING_JOURNEYS)).scalars().all())
+        return journeys
+
+    async def start_journey(self, journey: ActiveJourney):
+        async with self._session(write=True, store=self._person_store(journey.person_id)) as s:
+            await self._start_journeys(s, [journey])
+
+    async def archive_arrived_journeys(self, limit) -> int:
+        archived = 0
+        for store in self.shards:
+            archived += await self._archive_arrived_journeys_of_shard(store, limit)
+        return archived
+
+    async def _archive_arrived_journeys_of_shard(self, store, limit) -> int:
+        async with self._session(write=True, store=store) as s:
+            query = select(ActiveJourney.person_id)\
+                .where(ActiveJourney.arrived)\
+                .order_by(ActiveJourney.arrive_by)\
+                .limit(limit)
+            person_ids = (await s.execute(query)).scalars().all()
+            if person_ids:
+                await self._archive_arrived_journeys(s, person_ids)
+            return len(person_ids)
+
+    async def roll_up_journeys(self, arrived_before, limit) -> int:
+        rolled_up = 0
+        for store in self.shards:
+            rolled_up += await self._roll_up_journeys_of_shard(store, arrived_before, limit)
+        return rolled_up
+
+    async def _roll_up_journeys_of_shard(self, store, arrived_before, limit) -> int:
+        async with self._session(write=True, store=store) as s:
+            query = select(Journey.id)\
+                .where(Journey.arrive_by < arrived_before)\
+                .order_by(Journey.id)\
+                .limit(limit)
+            journey_ids = (await s.execute(query)).scalars().all()
+            if not journey_ids:
+                return 0
+
+            totals = select(
+                Journey.person_id,
+                func.count(Journey.id),
+                func.sum(Journey.arrive_by - func.coalesce(Journey.departed_at, Journey.arrive_by)),
+            )\
+                .where(Journey.id.in_(journey_ids))\
+                .group_by(Journey.person_id)
+            stmt = insert(TravelStatistics).from_select(
+                [TravelStatistics.person_id, TravelStatistics.journeys, TravelStatistics.travel_time],
+                totals,
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[TravelStatistics.person_id],
+                set_=dict(
+                    journeys=TravelStatistics.journeys + stmt.excluded.journeys,
+                    travel_time=TravelStatistics.travel_time + stmt.excluded.travel_time,
+                ),
+            )
+            await s.execute(stmt)
+            await s.execute(delete(Journey).where(Journey.id.in_(journey_ids)))
+            return len(journey_ids)
 
     async def delete(self, table: T, id):
-        async with self._new_session() as s:
+        async with self._session(write=True, store=self._table_store(table, id)) as s:
             stmt = delete(table).where(table.id == id)
             await s.execute(stmt)
-            await s.commit()
 
-    async def get_first_location(self):
-        async with self._new_session() as s:
-            query = select(Location).order_by(Location.id).limit(1)
-            return (await s.execute(query)).scalar()
+    async def get_world(self, with_paths=True) -> Tuple[List[Location], List[Item], List[Mob], List[Row], List[Row]]:
+        async with self._session(write=False, store=self.world_store) as s:
+            locations = (await s.execute(select(Location).order_by(Location.id))).scalars().all()
+            items = (await s.execute(select(Item).order_by(Item.id))).scalars().all()
+            mobs = (await s.execute(select(Mob).order_by(Mob.id))).scalars().all()
+            paths = []
+            if with_paths:
+                query = select(Path.from_location_id, Path.to_location_id, Path.distance)\
+                    .order_by(Path.id)
+                paths = (await s.execute(query)).all()
+            query = select(ItemInLocation.location_id, ItemInLocation.item_id)\
+                .order_by(ItemInLocation.id)
+            items_in_locations = (await s.execute(query)).all()
+            return locations, items, mobs, paths, items_in_locations
 
-    async def get_first_weapon(self):
-        async with self._new_session() as s:
-            query = select(Item)\
-                .where(and_(Item.req_level == 1, Item.item_type == ItemType.WEAPON))\
-                .order_by(Item.attack)\
-                .limit(1)
-            return (await s.execute(query)).scalar()
+    async def migrate(self):
+        if len(self.shards) == 1:
+            async with self.world_store.write_engine.begin() as connection:
+                await connection.run_sync(migrate)
+            return
 
-    async def dispose(self):
-        await self.engine.dispose()
-
-    async def get_items(self, person_id, only_worn=False) -> List[PersonItem]:
-        async with self._new_session() as s:
-            query = select(PersonItem)\
-                .options(selectinload(PersonItem.item))\
-                .where(and_(PersonItem.person_id == person_id, or_(PersonItem.put_on, not only_worn)))\
-                .order_by(desc(PersonItem.put_on))
-            return (await s.execute(query)).scalars()
-
-    async def get_person_item(self, person_id, item_id) -> PersonItem:
-        async with self._new_session() as s:
-            query = select(PersonItem)\
-                .options(selectinload(PersonItem.item))\
-                .where(and_(PersonItem.person_id == person_id, PersonItem.item_id == item_id))
-            return (await s.execute(query)).scalar()
+        async with self.world_store.write_engine.begin() as connection:
+            await connection.run_sync(migrate, WORLD_TABLES)
+        for store in self.shards:
+            async with store.write_engine.begin() as connection:
+                await connection.run_sync(migrate, PLAYER_TABLES)
 
-    async def get_all_items_in_location(self, location_id, person_level):
-        async with self._new_session() as s:
-            query = select(ItemInLocation)\
-                .join(Item)\
-                .options(selectinload(ItemInLocation.item))\
-                .where(and_(ItemInLocation.location_id == location_id, Item.req_level <= person_level))
-            items_in_location = (await s.execute(query)).scalars()
-            return list(map(lambda x: x.item, items_in_location))
-
-    async def get_item_in_location(self, item_id, location_id) -> ItemInLocation:
-        async with self._new_session() as s:
-            query = select(ItemInLocation)\
-                .options(selectinload(ItemInLocation.item))\
-                .where(and_(ItemInLocation.item_id == item_id, ItemInLocation.location_id == location_id))
-            return (await s.execute(query)).scalar()
+    async def warm_up(self):
+        # The first updates after a start would pay for mapper configuration, opening connections and compiling
+        # every statement. Here each shard runs every prebuilt statement once with parameters that match nothing,
+        # writes are rolled back.
+        configure_mappers()
+        for store in dict.fromkeys([self.world_store, *self.shards]):
+            await store.open_connections()
+        for store in self.shards:
+            async with store.ReadSession() as s:
+                for statement in statements.REGISTRY.values():
+                    if not statement.write:
+                        await s.execute(statement.statement, statement.sample)
+            async with store.WriteSession() as s:
+                for statement in statements.REGISTRY.values():
+                    if statement.write:
+                        await s.execute(statement.statement, statement.sample)
+                await s.rollback()
 
-    async def update_person_item_put_on(self, person_item_id, put_on):
-        async with self._new_session() as s:
-            stmt = update(PersonItem)\
-                .where(PersonItem.id == person_item_id)\
-                .values(put_on=put_on)
-            await s.execute(stmt)
-            await s.commit()
-
-    async def perform_transaction(
-        self,
-        person_id,
-        balance_change,
-        item_id,
-        quantity_change,
-    ):
-        if self.sign(balance_change) == self.sign(quantity_change):
-            return
+    async def dispose(self):
+        for store in {self.world_store, *self.shards}:
+            await store.dispose()
 
-        async with self._new_session() as s:
-            await self._update_user_balance(s, person_id, balance_change)
-
-            person_item = await self.get_person_item(person_id, item_id)
-            new_quantity = (person_item.quantity if person_item is not None else 0) + quantity_change
-
-            if (person_item is None and quantity_change < 0) or new_quantity < 0:
-                s.rollback()
-            elif person_item is None:
-                await self._create_and_get(
-                    session=s,
-                    entry=PersonItem(
-                        person_id=person_id,
-                        item_id=item_id,
-                        quantity=new_quantity,
-                        put_on=False,
-                    ),
-                )
-            elif new_quantity == 0:
-                stmt = delete(PersonItem).where(PersonItem.id == person_item.id)
-                await s.execute(stmt)
+    async def get_items(self, person_id, only_worn=False) -> List[Row]:
+        # Rows of (item_id, quantity, put_on), like the other person_item reads.
+        async with self._session(write=False, store=self._person_store(person_id)) as s:
+            query = statements.WORN_ITEMS if only_worn else statements.ITEMS
+            return (await s.execute(query, dict(person_id=person_id))).all()
+
+    async def get_items_page(self, person_id, cursor: Optional[Cursor], limit) -> List[Row]:
+        # Keyset on (person_id, item_id), the unique index of person_item, so a page reads at most `limit` rows.
+        async with self._session(write=False, store=self._person_store(person_id)) as s:
+            if cursor is None:
+                query, params = statements.ITEMS_FIRST_PAGE, dict(person_id=person_id, limit=limit)
+            elif cursor.forward:
+                query, params = statements.ITEMS_NEXT_PAGE, dict(person_id=person_id, key=cursor.key, limit=limit)
             else:
-                stmt = update(PersonItem)\
-                    .where(PersonItem.id == person_item.id)\
-                    .values(quantity=new_quantity)
-                await s.execute(stmt)
-            await s.commit()
-
-    async def get_available_paths(self, location_id) -> List[Path]:
-        async with self._new_session() as s:
-            query = select(Path)\
-                .options(selectinload(Path.from_location))\
-                .options(selectinload(Path.to_location))\
-                .where(Path.from_location_id == location_id)
-            return (await s.execute(query)).scalars()
-
-    async def get_path_by_from_and_to_points(self, from_location_id, to_location_id):
-        async with self._new_session() as s:
-            query = select(Path)\
-                .where(and_(Path.from_location_id == from_location_id, Path.to_location_id == to_location_id))
-            return (await s.execute(query)).scalar()
+                query, params = statements.ITEMS_PREVIOUS_PAGE, dict(person_id=person_id, key=cursor.key, limit=limit)
+            return (await s.execute(query, params)).all()
 
-    async def get_last_journey(self, person_id):
-        async with self._new_session() as s:
-            query = select(Journey)\
-                .options(selectinload(Journey.from_location))\
-                .options(selectinload(Journey.to_location))\
-                .where(Journey.person_id == person_id)\
-                .order_by(desc(Journey.arrive_by))
-            return (await s.execute(query)).scalar()
+    async def get_person_item(self, person_id, item_id) -> Optional[Row]:
+        async with self._session(write=False, store=self._person_store(person_id)) as s:
+            return (await s.execute(statements.PERSON_ITEM, dict(person_id=person_id, item_id=item_id))).first()
 
-    async def update_person_location_and_state(self, person_id, new_location_id, hp):
-        async with self._new_session() as s:
-            stmt = update(Person)\
-                .where(Person.id == person_id)\
-                .values(location_id=new_location_id, hp=hp)
-            await s.execute(stmt)
-            await s.commit()
+    async def set_item_put_on(self, person_id, item: Item, put_on) -> bool:
+        async with self._session(write=True, store=self._person_store(person_id)) as s:
+            params = dict(b_person_id=person_id, b_item_id=item.id, new_put_on=put_on)
+            if (await s.execute(statements.SET_PUT_ON, params)).rowcount == 0:
+                return False
+
+            await self._add_bonuses(s, person_id, item, 1 if put_on else -1)
+            return True
+
+    async def buy_items(self, person_id, cost, quantities: Dict[int, int]) -> bool:
+        async with self._session(write=True, store=self._person_store(person_id)) as s:
+            if (await s.execute(statements.CHARGE, dict(person_id=person_id, cost=cost))).rowcount == 0:
+                return False
+
+            await s.execute(statements.ADD_ITEMS, [
+                dict(person_id=person_id, item_id=item_id, quantity=quantity, put_on=False)
+                for item_id, quantity in quantities.items()
+            ])
+            return True
 
-    def _new_session(self) -> AsyncSession:
-        return self.AsyncSession()
+    async def sell_item(self, person_id, item: Item, quantity, gain) -> Tuple[bool, bool]:
+        async with self._session(write=True, store=self._person_store(person_id)) as s:
+            person_item = dict(b_person_id=person_id, b_item_id=item.id)
+            if (await s.execute(statements.TAKE_ITEMS, dict(person_item, taken=quantity))).rowcount == 0:
+                return False, False
+
+            put_on = (await s.execute(statements.SOLD_OUT_PUT_ON, person_item)).scalar()
+            if put_on is not None:
+                await s.execute(statements.DELETE_SOLD_OUT, person_item)
+            if put_on:
+                await self._add_bonuses(s, person_id, item, -1)
+
+            await s.execute(statements.PAY, dict(person_id=person_id, gain=gain))
+            return True, bool(put_on)
+
+    async def apply_arrivals(self, arrivals):
+        by_shard = {}
+        for arrival in arrivals:
+            by_shard.setdefault(shard_of_person(arrival.person_id, len(self.shards)), []).append(arrival)
+        for shard, shard_arrivals in by_shard.items():
+            await self._apply_arrivals_of_shard(self.shards[shard], shard_arrivals)
+
+    async def _apply_arrivals_of_shard(self, store, arrivals):
+        # The new location and hp of the persons are written behind by PlayerCache.
+        async with self._session(write=True, store=store) as s:
+            await s.execute(statements.MARK_ARRIVED, [
+                dict(b_person_id=arrival.person_id, b_arrive_by=arrival.arrive_by) for arrival in arrivals
+            ])
+
+            next_legs = [arrival.next_leg for arrival in arrivals if arrival.next_leg is not None]
+            if next_legs:
+                await self._start_journeys(s, next_legs)
+
+    async def update_persons(self, changes: Dict[int, dict]):
+        # One transaction per shard, persons that changed the same fields share one executemany.
+        by_shard = {}
+        for person_id, fields in changes.items():
+            by_shard.setdefault(shard_of_person(person_id, len(self.shards)), {})\
+                .setdefault(tuple(sorted(fields)), [])\
+                .append(dict({f'new_{name}': value for name, value in fields.items()}, person_id=person_id))
+        for shard, by_fields in by_shard.items():
+            async with self.unit_of_work():
+                async with self._session(write=True, store=self.shards[shard]) as s:
+                    for fields, rows in by_fields.items():
+                        await s.execute(statements.update_person_fields(fields), rows)
+
+    def _player_store(self, external_id) -> SqliteStore:
+        return self.shards[shard_of_player(external_id, len(self.shards))]
+
+    def _person_store(self, person_id) -> SqliteStore:
+        return self.shards[shard_of_person(person_id, len(self.shards))]
+
+    def _table_store(self, table, id) -> SqliteStore:
+        if table.__table__ in WORLD_TABLES:
+            return self.world_store
+        elif table is Person:
+            return self._person_store(id)
+        elif len(self.shards) == 1:
+            return self.shards[0]
+        raise ValueError(f'{table.__tablename__} rows are sharded by person, they have no global id')
+
+    @asynccontextmanager
+    async def _session(self, write, store: SqliteStore):
+        async with self.unit_of_work() as unit_of_work:
+            yield unit_of_work.session(store, write)
 
     @staticmethod
-    async def _update_user_balance(session, person_id, balance_change):
-        query = select(Person).where(Person.id == person_id)
-        person = (await session.execute(query)).scalar()
+    async def _add_bonuses(session, person_id, item: Item, sign):
+        await session.execute(statements.ADD_BONUSES, dict(
+            person_id=person_id, **{f'add_{name}': sign * getattr(item, name) for name in ITEM_BONUS_PROPERTIES},
+        ))
 
-        if person.money + balance_change < 0:
-            session.rollback()
+    @classmethod
+    async def _start_journeys(cls, session, journeys: List[ActiveJourney]):
+        await cls._archive_arrived_journeys(session, [journey.person_id for journey in journeys])
+        await session.execute(statements.START_JOURNEY, [
+            dict(
+                person_id=journey.person_id,
+                from_location_id=journey.from_location_id,
+                to_location_id=journey.to_location_id,
+                departed_at=journey.departed_at,
+                arrive_by=journey.arrive_by,
+                remaining_route=journey.remaining_route,
+                arrived=False,
+            )
+            for journey in journeys
+        ])
 
-        stmt = update(Person)\
-            .where(Person.id == person_id)\
-            .values(money=person.money + balance_change)
-        await session.execute(stmt)
+    @staticmethod
+    async def _archive_arrived_journeys(session, person_ids):
+        await session.execute(statements.ARCHIVE_ARRIVED, dict(person_ids=person_ids))
+        await session.execute(statements.DELETE_ARRIVED, dict(person_ids=person_ids))
 
     @staticmethod
     async def _create_and_get(session, entry):
         session.add(entry)
-        await session.commit()
+        await session.flush()
         await session.refresh(entry)
 
-    @staticmethod
-    def sign(x):
-        if x > 0:
-            return 1
-        elif x < 0:
-            return -1
-        else:
-            return 0
\ No newline at end of file
@@ -1,138 +1,150 @@
+import argparse
+import math
 import random
-import sqlite3
-from typing import List
+from itertools import islice
+from time import perf_counter
 
-from sqlalchemy import create_engine
-from sqlalchemy.future import select
-from sqlalchemy.orm import Session, sessionmaker
+import numpy as np
+from sqlalchemy import create_engine, insert
 
+import config
 from dto import meta, Location, LocationType, Mob, AttackType, ItemType, Item, ItemInLocation, Path
+from spatial_index import neighbour_pairs
 
-database_name = 'game.db'
+database_name = config.GAME_DATABASE
 
 
 class GameDataInitializer:
-    def __init__(self, engine):
-        self.Session = sessionmaker(bind=engine, future=True, expire_on_commit=False)
+    def __init__(self, engine, locations=40, grid_size=None, max_distance=config.PATH_MAX_DISTANCE, seed=None,
+                 create_paths=True, chunk_size=50_000):
+        self.engine = engine
+        self.locations = locations
+        self.grid_size = grid_size or max(21, math.ceil(math.sqrt(locations * 21 * 21 / 40)))
+        self.max_distance = max_distance
+        self.create_paths = create_paths
+        self.chunk_size = chunk_size
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self._xs = self._ys = self._location_types = None
+        self._items = []
 
     def generate_world(self):
-        self._generate_locations()
-        self._generate_mobs()
-        self._generate_items()
-        self._distribute_items()
-        self._create_paths()
-
-    def _generate_locations(self):
-        locations = []
-        existing_coord = set()
-        for i in range(20):
-            for type in LocationType.text_to_entry.values():
-                x_coord, y_coord = (random.randint(0, 20), random.randint(0, 20))
-                while (x_coord, y_coord) in existing_coord:
-                    x_coord, y_coord = (random.randint(0, 20), random.randint(0, 20))
-                locations.append(
-                    Location(
-                        x_coord=x_coord,
-                        y_coord=y_coord,
-                        location_type=type,
-                    )
-                )
-                existing_coord.add((x_coord, y_coord))
-
-        self._create_objects(locations)
-
-    def _generate_mobs(self):
+        with self.engine.begin() as connection:
+            self._generate_locations(connection)
+            self._generate_mobs(connection)
+            self._generate_items(connection)
+            self._distribute_items(connection)
+            if self.create_paths:
+                self._create_paths(connection)
+
+    def _generate_locations(self, connection):
+        if self.locations > self.grid_size * self.grid_size:
+            raise ValueError(f'{self.locations} locations do not fit on a {self.grid_size}x{self.grid_size} grid')
+
+        cells = self.rng.choice(self.grid_size * self.grid_size, size=self.locations, replace=False)
+        self._xs, self._ys = np.divmod(cells.astype(np.int64), self.grid_size)
+        location_types = list(LocationType.text_to_entry.values())
+        self._location_types = np.resize(np.arange(len(location_types)), self.locations)
+
+        self._insert(connection, Location, ('id', 'x_coord', 'y_coord', 'location_type'), (
+            (i + 1, x, y, location_types[t])
+            for i, (x, y, t) in enumerate(zip(self._xs.tolist(), self._ys.tolist(), self._location_types.tolist()))
+        ))
+
+    def _generate_mobs(self, connection):
         mobs = []
         for req_level in range(1, 6):
             for attack_type in AttackType.text_to_entry.values():
                 mobs.append(
-                    Mob(
+                    dict(
                         hp=req_level * 100,
                         xp=req_level * 25,
                         req_level=req_level,
                         attack_type=attack_type,
-                        attack=req_level * random.randint(10, 15),
-                        armour=req_level * random.randint(1 + req_level, 10),
-                        magic_armour=req_level * random.randint(1 + req_level, 10),
+                        attack=req_level * self.random.randint(10, 15),
+                        armour=req_level * self.random.randint(1 + req_level, 10),
+                        magic_armour=req_level * self.random.randint(1 + req_level, 10),
                     )
                 )
 
-        self._create_objects(mobs)
+        self._insert(connection, Mob, tuple(mobs[0]), (tuple(mob.values()) for mob in mobs))
 
-    def _generate_items(self):
-        items = []
+    def _generate_items(self, connection):
+        self._items = []
         for req_level in range(1, 6):
             for item_type in ItemType.text_to_entry.values():
-                items.append(
-                    Item(
+                self._items.append(
+                    dict(
+                        id=len(self._items) + 1,
                         cost=req_level * 50,
                         cost_to_sale=req_level * 50 * 80 / 100,
                         item_type=item_type,
                         hp=req_level * 10,
                         mana=req_level * 10,
-                        attack=req_level * random.randint(11, 16),
-                        magic_attack=req_level * random.randint(11, 16),
-                        armour=req_level * random.randint(2 + req_level, 11),
-                        magic_armour=req_level * random.randint(2 + req_level, 11),
+                        attack=req_level * self.random.randint(11, 16),
+                        magic_attack=req_level * self.random.randint(11, 16),
+                        armour=req_level * self.random.randint(2 + req_level, 11),
+                        magic_armour=req_level * self.random.randint(2 + req_level, 11),
                         req_level=req_level,
                     )
                 )
-        self._create_objects(items)
-
-    def _distribute_items(self):
-        with self._new_session() as s:
-            items: List[Item] = s.execute(select(Item)).scalars().all()
-            locations: List[Location] = s.execute(select(Location).where(Location.location_type == LocationType.TOWN)).scalars().all()
-
-        items_in_locations = []
-        for item in items:
-            for location in locations:
-                if random.uniform(0, 1) >= (1 - 1.0 / item.req_level) or item.item_type == ItemType.POTION:
-                    items_in_locations.append(
-                        ItemInLocation(
-                            location_id=location.id,
-                            item_id=item.id,
-                        )
-                    )
-        self._create_objects(items_in_locations)
-
-    def _create_paths(self):
-        with self._new_session() as s:
-            locations: List[Location] = s.execute(select(Location)).scalars().all()
-
-        paths = []
-        for from_loc in locations:
-            for to_loc in locations:
-                if from_loc == to_loc:
-                    continue
-
-                distance = abs(from_loc.x_coord - to_loc.x_coord) + abs(from_loc.y_coord - to_loc.y_coord)
-                if distance > 10:
-                    continue
-
-                paths.append(
-                    Path(
-                        from_location_id=from_loc.id,
-                        to_location_id=to_loc.id,
-                        distance=distance,
-                    )
-                )
-        self._create_objects(paths)
-
-    def _new_session(self) -> Session:
-        return self.Session()
-
-    def _create_objects(self, objects):
-        with self._new_session() as s:
-            s.add_all(objects)
-            s.commit()
+        self._insert(connection, Item, tuple(self._items[0]), (tuple(item.values()) for item in self._items))
+
+    def _distribute_items(self, connection):
+        town = list(LocationType.text_to_entry.values()).index(LocationType.TOWN)
+        town_ids = np.flatnonzero(self._location_types == town) + 1
+        item_ids = np.array([item['id'] for item in self._items])
+        thresholds = np.array([
+            0.0 if item['item_type'] == ItemType.POTION else 1 - 1.0 / item['req_level'] for item in self._items
+        ])
+
+        item_index, town_index = np.nonzero(self.rng.random((len(item_ids), len(town_ids))) >= thresholds[:, None])
+        self._insert(connection, ItemInLocation, ('location_id', 'item_id'), zip(
+            town_ids[town_index].tolist(), item_ids[item_index].tolist(),
+        ))
+
+    def _create_paths(self, connection):
+        sources, targets, distances = neighbour_pairs(self._xs, self._ys, self.max_distance)
+        self._insert(connection, Path, ('from_location_id', 'to_location_id', 'distance'), zip(
+            (sources + 1).tolist(), (targets + 1).tolist(), distances.tolist(),
+        ))
+
+    def _insert(self, connection, model, columns, rows):
+        # Compiled once, then handed to the driver's executemany: per-row parameter processing dominates otherwise.
+        statement = insert(model.__table__).compile(dialect=connection.dialect, column_keys=columns)
+        if list(statement.positiontup) != list(columns):
+            raise ValueError(f'{model.__tablename__} rows are {list(columns)}, the statement expects '
+                             f'{list(statement.positiontup)}')
+        sql = str(statement)
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            connection.exec_driver_sql(sql, chunk)
 
 
 if __name__ == '__main__':
-    sqlite3.connect(database_name).close()
-    engine = create_engine(f'sqlite+pysqlite:///{database_name}', echo=True)
-
+    parser = argparse.ArgumentParser(description='Generates a new game world.')
+    parser.add_argument('--database', default=database_name)
+    parser.add_argument('--locations', type=int, default=40)
+    parser.add_argument('--grid-size', type=int, default=None)
+    parser.add_argument('--max-distance', type=int, default=config.PATH_MAX_DISTANCE)
+    parser.add_argument('--no-paths', action='store_true')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    engine = create_engine(f'sqlite+pysqlite:///{args.database}')
     meta.drop_all(engine)
     meta.create_all(engine)
 
-    GameDataInitializer(engine=engine).generate_world()
+    started = perf_counter()
+    GameDataInitializer(
+        engine=engine,
+        locations=args.locations,
+        grid_size=args.grid_size,
+        max_distance=args.max_distance,
+        seed=args.seed,
+        create_paths=not args.no_paths,
+    ).generate_world()
+    print(f'Generated {args.locations} locations in {perf_counter() - started:.1f}s')
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+from time import time
+from typing import Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class JourneyCompactor:
+    def __init__(
+        self,
+        dao,
+        interval=config.JOURNEY_COMPACTION_INTERVAL_SECONDS,
+        batch_size=config.JOURNEY_COMPACTION_BATCH_SIZE,
+        rollup_after=config.JOURNEY_ROLLUP_AFTER_SECONDS,
+    ):
+        self.dao = dao
+        self.interval = interval
+        self.batch_size = batch_size
+        self.rollup_after = rollup_after
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def compact(self) -> int:
+        archived = 0
+        while True:
+            moved = await self.dao.archive_arrived_journeys(self.batch_size)
+            archived += moved
+            if moved < self.batch_size:
+                return archived
+            await asyncio.sleep(0)
+
+    async def roll_up(self, arrived_before) -> int:
+        rolled_up = 0
+        while True:
+            moved = await self.dao.roll_up_journeys(arrived_before, self.batch_size)
+            rolled_up += moved
+            if moved < self.batch_size:
+                return rolled_up
+            await asyncio.sleep(0)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.compact()
+                if self.rollup_after > 0:
+                    await self.roll_up(time() - self.rollup_after)
+            except Exception:
+                logger.exception('Failed to compact journeys')
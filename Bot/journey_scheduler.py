@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+import logging
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+import config
+from dto import ActiveJourney, LocationType
+
+logger = logging.getLogger(__name__)
+
+
+class Arrival:
+    def __init__(self, journey, person_id, from_location_id, to_location_id, arrive_by, restores_hp, next_leg):
+        self.journey: ActiveJourney = journey
+        self.person_id = person_id
+        self.from_location_id = from_location_id
+        self.to_location_id = to_location_id
+        self.arrive_by = arrive_by
+        self.restores_hp = restores_hp
+        self.next_leg: Optional[ActiveJourney] = next_leg
+
+
+def parse_route(remaining_route) -> List[int]:
+    return [int(location_id) for location_id in remaining_route.split(',')] if remaining_route else []
+
+
+def format_route(location_ids) -> Optional[str]:
+    return ','.join(map(str, location_ids)) or None
+
+
+class JourneyScheduler:
+    def __init__(self, dao, world, players, tick=config.JOURNEY_TICK_SECONDS):
+        self.dao = dao
+        self.world = world
+        self.players = players
+        self.tick = tick
+        self.traveling_until: Dict[int, float] = {}
+        self._journeys: Dict[int, ActiveJourney] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._heap = []
+        self._journeys = {}
+        self.traveling_until = {}
+        for journey in await self.dao.get_pending_journeys():
+            self.schedule(journey)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, journey: ActiveJourney):
+        self._journeys[journey.person_id] = journey
+        self.traveling_until[journey.person_id] = self._final_arrival(journey)
+        heapq.heappush(self._heap, (journey.arrive_by, journey.person_id))
+        if self._heap[0] == (journey.arrive_by, journey.person_id):
+            self._wakeup.set()
+
+    def restore(self, arrivals: List[Arrival]):
+        # The arrivals were rolled back, their journeys are due again.
+        for arrival in arrivals:
+            self.schedule(arrival.journey)
+
+    async def apply_due(self, now) -> List[Arrival]:
+        # Called by the background task only: every shard is written in a unit of work of its own.
+        applied = []
+        while True:
+            arrivals = self._pop_due(now)
+            if not arrivals:
+                return applied
+            await self._apply(arrivals)
+            applied.extend(arrivals)
+
+    async def apply_arrival(self, person_id, now) -> Optional[Arrival]:
+        # The due journey of one player, applied inline in the unit of work of the player's update, so it only
+        # touches the player's shard. The other due journeys are left to the background task.
+        journey = self._journeys.get(person_id)
+        if journey is None or journey.arrive_by > now:
+            return None
+        del self._journeys[person_id]
+        arrival = self._arrival(journey)
+        await self._apply([arrival])
+        return arrival
+
+    async def _apply(self, arrivals: List[Arrival]):
+        # The journeys of the arrivals are already out of _journeys, so no one else applies them meanwhile.
+        try:
+            # Journaled first: after a crash the replayed location wins over the journey still marked pending,
+            # whose arrival then sets the same location again.
+            self.players.record_arrivals(arrivals)
+            await self.dao.apply_arrivals(arrivals)
+        except BaseException:
+            self.restore(arrivals)
+            raise
+
+        for arrival in arrivals:
+            if arrival.person_id in self._journeys:
+                # A journey scheduled during the write is newer than this arrival and its next leg.
+                continue
+            if arrival.next_leg is not None:
+                self.schedule(arrival.next_leg)
+            else:
+                self.traveling_until.pop(arrival.person_id, None)
+
+    def _pop_due(self, now) -> List[Arrival]:
+        arrivals = []
+        while self._heap and self._heap[0][0] <= now:
+            arrive_by, person_id = heapq.heappop(self._heap)
+            journey = self._journeys.get(person_id)
+            if journey is None or journey.arrive_by != arrive_by:
+                continue
+            del self._journeys[person_id]
+            arrivals.append(self._arrival(journey))
+        return arrivals
+
+    def _arrival(self, journey: ActiveJourney) -> Arrival:
+        return Arrival(
+            journey=journey,
+            person_id=journey.person_id,
+            from_location_id=journey.from_location_id,
+            to_location_id=journey.to_location_id,
+            arrive_by=journey.arrive_by,
+            restores_hp=self.world.location(journey.to_location_id).location_type == LocationType.TOWN,
+            next_leg=self._next_leg(journey),
+        )
+
+    def _next_leg(self, journey: ActiveJourney) -> Optional[ActiveJourney]:
+        route = parse_route(journey.remaining_route)
+        path = self.world.path(journey.to_location_id, route[0]) if route else None
+        if path is None:
+            return None
+        return ActiveJourney(
+            person_id=journey.person_id,
+            from_location_id=path.from_location_id,
+            to_location_id=path.to_location_id,
+            departed_at=journey.arrive_by,
+            arrive_by=journey.arrive_by + path.distance,
+            remaining_route=format_route(route[1:]),
+        )
+
+    def _final_arrival(self, journey: ActiveJourney) -> float:
+        arrive_by = journey.arrive_by
+        location_id = journey.to_location_id
+        for next_location_id in parse_route(journey.remaining_route):
+            path = self.world.path(location_id, next_location_id)
+            if path is None:
+                break
+            arrive_by += path.distance
+            location_id = next_location_id
+        return arrive_by
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = max(self._heap[0][0] - time(), self.tick) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await self.apply_due(time())
+            except Exception:
+                logger.exception('Failed to apply journey arrivals')
@@ -0,0 +1,206 @@
+import inspect
+import re
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+from sqlalchemy import event
+
+import config
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def _labels(self, values, extra=()) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return super().render() + [f'{self.name}{self._labels(labels)} {value}' for labels, value in self._values.items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, *labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{self._labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(labels)} {total}')
+            lines.append(f'{self.name}_count{self._labels(labels)} {cumulative}')
+        return lines
+
+
+REGISTRY: List[Metric] = []
+
+UPDATE_SECONDS = Histogram('game_update_seconds', 'Time to process one update, commit included.')
+UPDATE_QUERIES = Histogram(
+    'game_update_queries', 'SQL statements executed while processing one update.', buckets=COUNT_BUCKETS,
+)
+HANDLER_SECONDS = Histogram('game_handler_seconds', 'Time spent in a message handler.', ['handler'])
+ENGINE_SECONDS = Histogram('game_engine_seconds', 'Time spent in a GameAsyncEngine method.', ['method'])
+DB_STATEMENT_SECONDS = Histogram(
+    'game_db_statement_seconds', 'SQLite statement execution time.', ['engine', 'statement'],
+)
+COMMIT_SECONDS = Histogram('game_commit_seconds', 'Time to commit the unit of work of an update.')
+BOT_API_SECONDS = Histogram('game_bot_api_seconds', 'Time of a Telegram Bot API call.', ['method'])
+ERRORS = Counter('game_update_errors_total', 'Updates that raised an exception.')
+THROTTLE_ALLOWED = Counter('game_throttle_allowed_total', 'Commands that passed the rate limits.', ['command'])
+THROTTLED = Counter('game_throttled_total', 'Commands rejected by the rate limits.', ['scope', 'command'])
+UPDATES_SHED = Counter('game_updates_shed_total', 'Updates dropped because the player had too many queued.')
+MAILBOX_WAIT_SECONDS = Histogram('game_mailbox_wait_seconds', "Time an update waited for the player's previous ones.")
+WEBHOOK_WAIT_SECONDS = Histogram('game_webhook_wait_seconds', 'Time a webhook update waited for a free worker.')
+WEBHOOK_REJECTED = Counter('game_webhook_rejected_total', 'Webhook updates answered with 503 because too many were pending.')
+PLAYER_CACHE_LOOKUPS = Counter('game_player_cache_lookups_total', 'Player state lookups by cache result.', ['result'])
+PLAYER_CACHE_FLUSH_SECONDS = Histogram('game_player_cache_flush_seconds', 'Time to write the changed persons to SQLite.')
+PLAYER_CACHE_FLUSHED = Counter('game_player_cache_flushed_total', 'Changed persons written to SQLite by the cache.')
+
+_update_queries: ContextVar[Optional[list]] = ContextVar('update_queries', default=None)
+_statement_pattern = re.compile(
+    r'\s*(\w+)(?:\s+"?(\w+)"?\s+SET\b|.*?\b(?:FROM|INTO|TABLE)\s+"?(\w+))?', re.IGNORECASE | re.DOTALL,
+)
+
+
+@contextmanager
+def track_update():
+    queries = [0]
+    token = _update_queries.set(queries)
+    started = perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc()
+        raise
+    finally:
+        UPDATE_SECONDS.observe(perf_counter() - started)
+        UPDATE_QUERIES.observe(queries[0])
+        _update_queries.reset(token)
+
+
+def timed_methods(histogram: Histogram):
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if not name.startswith('_') and inspect.iscoroutinefunction(method):
+                setattr(cls, name, _timed(method, histogram, name))
+        return cls
+    return decorate
+
+
+def instrument_engine(sync_engine, label):
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info['query_started'].pop()
+        DB_STATEMENT_SECONDS.observe(elapsed, label, statement_name(statement))
+        queries = _update_queries.get()
+        if queries is not None:
+            queries[0] += 1
+
+
+def statement_name(statement) -> str:
+    match = _statement_pattern.match(statement)
+    if not match:
+        return 'OTHER'
+    verb, table = match.group(1).upper(), match.group(2) or match.group(3)
+    return f'{verb} {table}' if table else verb
+
+
+def render() -> str:
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+class MetricsServer:
+    def __init__(self, host=config.METRICS_HOST, port=config.METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    async def _metrics(request):
+        return web.Response(body=render().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+def _timed(method, histogram: Histogram, name):
+    @wraps(method)
+    async def timed(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - started, name)
+    return timed
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
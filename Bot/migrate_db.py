@@ -0,0 +1,156 @@
+import argparse
+from time import time
+from typing import List
+
+from sqlalchemy import Column, create_engine, event, inspect, text
+
+import config
+from dto import meta, PersonItem, ActiveJourney, Journey, Person, ITEM_BONUS_PROPERTIES, PLAYER_TABLES, WORLD_TABLES
+from init_db import database_name
+from sharding import shard_databases
+from storage import attach_read_only
+
+_STALE_BONUSES = f"""
+    SELECT p.id FROM person p
+    LEFT JOIN (
+        SELECT pi.person_id, {', '.join(f'SUM(i.{name}) AS {name}' for name in ITEM_BONUS_PROPERTIES)}
+        FROM person_item pi JOIN item i ON i.id = pi.item_id
+        WHERE pi.put_on
+        GROUP BY pi.person_id
+    ) w ON w.person_id = p.id
+    WHERE {' OR '.join(f'p.bonus_{name} != COALESCE(w.{name}, 0)' for name in ITEM_BONUS_PROPERTIES)}
+"""
+
+
+def migrate(connection, tables=None):
+    # `tables` limits the migration to a part of the schema, e.g. the player tables of a shard.
+    tables = [table for table in meta.sorted_tables if tables is None or table in tables]
+    existing_tables = set(inspect(connection).get_table_names())
+    meta.create_all(connection, tables=tables, checkfirst=True)
+    added_columns = _add_missing_columns(connection, tables)
+    if ActiveJourney.__table__ in tables and ActiveJourney.__tablename__ not in existing_tables \
+            and Journey.__tablename__ in existing_tables:
+        _move_pending_journeys(connection)
+
+    existing_indexes = {
+        table.name: {index['name'] for index in inspect(connection).get_indexes(table.name)}
+        for table in tables
+    }
+    if PersonItem.__table__ in tables and \
+            not any(index.name in existing_indexes[PersonItem.__tablename__] for index in PersonItem.__table__.indexes):
+        _merge_duplicate_person_items(connection)
+
+    created = False
+    for table in tables:
+        for index in table.indexes:
+            if index.name not in existing_indexes[table.name]:
+                index.create(connection)
+                created = True
+
+    if any(column.table is Person.__table__ for column in added_columns):
+        rebuild_person_bonuses(connection)
+
+    if created:
+        connection.execute(text('ANALYZE'))
+
+
+def check_person_bonuses(connection) -> List[int]:
+    return connection.execute(text(f'{_STALE_BONUSES} ORDER BY p.id')).scalars().all()
+
+
+def rebuild_person_bonuses(connection) -> int:
+    worn = 'FROM person_item pi JOIN item i ON i.id = pi.item_id WHERE pi.person_id = person.id AND pi.put_on'
+    return connection.execute(text(
+        f"""
+        UPDATE person
+        SET {', '.join(f'bonus_{name} = COALESCE((SELECT SUM(i.{name}) {worn}), 0)' for name in ITEM_BONUS_PROPERTIES)}
+        WHERE id IN ({_STALE_BONUSES})
+        """
+    )).rowcount
+
+
+def _add_missing_columns(connection, tables) -> List[Column]:
+    added_columns = []
+    inspector = inspect(connection)
+    for table in tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            default = ''
+            if column.server_default is not None:
+                default = f' DEFAULT {getattr(column.server_default.arg, "text", column.server_default.arg)}'
+            connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+            added_columns.append(column)
+    return added_columns
+
+
+def _move_pending_journeys(connection):
+    pending_ids = connection.execute(text(
+        """
+        SELECT j.id FROM journey j
+        JOIN person p ON p.id = j.person_id
+        WHERE j.id = (SELECT id FROM journey WHERE person_id = j.person_id ORDER BY arrive_by DESC LIMIT 1)
+            AND (j.arrive_by > :now OR p.location_id = j.from_location_id)
+        """
+    ), dict(now=time())).scalars().all()
+    if not pending_ids:
+        return
+
+    ids = ', '.join(map(str, pending_ids))
+    connection.execute(text(
+        f"""
+        INSERT INTO active_journey (person_id, from_location_id, to_location_id, departed_at, arrive_by, arrived)
+        SELECT person_id, from_location_id, to_location_id, departed_at, arrive_by, 0 FROM journey WHERE id IN ({ids})
+        """
+    ))
+    connection.execute(text(f'DELETE FROM journey WHERE id IN ({ids})'))
+
+
+def _merge_duplicate_person_items(connection):
+    connection.execute(text(
+        """
+        UPDATE person_item
+        SET quantity = (
+                SELECT SUM(p.quantity) FROM person_item p
+                WHERE p.person_id = person_item.person_id AND p.item_id = person_item.item_id
+            ),
+            put_on = (
+                SELECT MAX(p.put_on) FROM person_item p
+                WHERE p.person_id = person_item.person_id AND p.item_id = person_item.item_id
+            )
+        WHERE id IN (SELECT MIN(id) FROM person_item GROUP BY person_id, item_id HAVING COUNT(*) > 1)
+        """
+    ))
+    connection.execute(text(
+        'DELETE FROM person_item WHERE id NOT IN (SELECT MIN(id) FROM person_item GROUP BY person_id, item_id)'
+    ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Upgrades game.db in place.')
+    parser.add_argument('--check-bonuses', action='store_true')
+    parser.add_argument('--rebuild-bonuses', action='store_true')
+    args = parser.parse_args()
+
+    # Sharded: game.db keeps the world tables and every shard the player tables, with game.db attached.
+    databases = [(database_name, None)]
+    if config.SHARD_COUNT > 1:
+        databases = [(database_name, WORLD_TABLES)] + [(shard, PLAYER_TABLES) for shard in shard_databases()]
+
+    for database, tables in databases:
+        engine = create_engine(f'sqlite+pysqlite:///{database}')
+        if tables is PLAYER_TABLES:
+            event.listen(engine, 'connect', lambda dbapi_connection, _: dbapi_connection.execute(
+                attach_read_only(database_name),
+            ))
+        with engine.begin() as connection:
+            migrate(connection, tables)
+            if tables is WORLD_TABLES:
+                continue
+            if args.check_bonuses:
+                person_ids = check_person_bonuses(connection)
+                print(f'{database}: {len(person_ids)} persons with stale bonuses: {person_ids[:20]}')
+            if args.rebuild_bonuses:
+                print(f'{database}: rebuilt bonuses of {rebuild_person_bonuses(connection)} persons')
@@ -0,0 +1,65 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import Callable, List, Optional, Sequence
+
+_cursor_pattern = re.compile('([np])([0-9]+)')
+
+
+class Cursor:
+    # Keyset position: the entries after `key` (next page) or before it (previous page), never an offset.
+    def __init__(self, key, forward=True):
+        self.key = key
+        self.forward = forward
+
+    def __str__(self):
+        return f"{'n' if self.forward else 'p'}{self.key}"
+
+    @staticmethod
+    def parse(text) -> Optional['Cursor']:
+        match = _cursor_pattern.fullmatch(text or '')
+        if not match:
+            return None
+        return Cursor(int(match.group(2)), match.group(1) == 'n')
+
+
+class Page:
+    def __init__(self, entries: List, previous: Optional[Cursor], next: Optional[Cursor], key: Callable):
+        self.entries = entries
+        self.previous = previous
+        self.next = next
+        self.key = key
+
+    def cut(self, count) -> 'Page':
+        # Only the first `count` entries were shown, Next continues right after the last of them.
+        if count >= len(self.entries):
+            return self
+        entries = self.entries[:count]
+        return Page(entries, self.previous, Cursor(self.key(entries[-1])), self.key)
+
+
+def page_of_rows(rows: Sequence, cursor: Optional[Cursor], size, key: Callable) -> Page:
+    # `rows` are up to size + 1 entries read from the cursor on in its direction, the extra one only tells
+    # whether there is another page that way.
+    more = len(rows) > size
+    rows = list(rows[:size])
+    if cursor is not None and not cursor.forward:
+        rows.reverse()
+        previous = Cursor(key(rows[0]), forward=False) if more and rows else None
+        next = Cursor(key(rows[-1])) if rows else None
+    else:
+        previous = Cursor(key(rows[0]), forward=False) if cursor is not None and rows else None
+        next = Cursor(key(rows[-1])) if more else None
+    return Page(rows, previous, next, key)
+
+
+def page_of_sorted(entries: Sequence, cursor: Optional[Cursor], size, key: Callable) -> Page:
+    # The same pages over a list already sorted by key, found by bisection.
+    if cursor is None:
+        rows = entries[:size + 1]
+    elif cursor.forward:
+        start = bisect_right(entries, cursor.key, key=key)
+        rows = entries[start:start + size + 1]
+    else:
+        end = bisect_left(entries, cursor.key, key=key)
+        rows = entries[max(0, end - size - 1):end][::-1]
+    return page_of_rows(rows, cursor, size, key)
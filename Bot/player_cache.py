@@ -0,0 +1,192 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+import config
+import metrics
+from records import PersonRecord
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerJournal:
+    # Append-only segments <path>.<n> of JSON lines {"id": person_id, field: value, ...}. A change is written here
+    # before it is acknowledged, and a segment is deleted only after its changes are committed to SQLite, so a crash
+    # between the two is repaired by replaying the segments on the next start.
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._segment = 0
+        self._file = None
+
+    def segments(self) -> List[str]:
+        return sorted(glob.glob(f'{glob.escape(self.path)}.[0-9]*'), key=lambda name: int(name.rsplit('.', 1)[1]))
+
+    def replay(self) -> Dict[int, dict]:
+        changes: Dict[int, dict] = {}
+        for segment in self.segments():
+            with open(segment) as file:
+                for line in file:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        # A torn last line of a crashed write, nothing after it was acknowledged.
+                        break
+                    changes.setdefault(change.pop('id'), {}).update(change)
+        segments = self.segments()
+        self._segment = int(segments[-1].rsplit('.', 1)[1]) if segments else 0
+        return changes
+
+    def append(self, changes: Dict[int, dict]):
+        if self._file is None:
+            self._segment += 1
+            self._file = open(f'{self.path}.{self._segment}', 'a')
+        self._file.write(''.join(json.dumps(dict(id=person_id, **fields)) + '\n' for person_id, fields in changes.items()))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def rotate(self) -> int:
+        # Closes the current segment, later changes go to a new one. Returns the last closed segment number.
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self._segment
+
+    def discard(self, up_to_segment):
+        for segment in self.segments():
+            if int(segment.rsplit('.', 1)[1]) <= up_to_segment:
+                os.remove(segment)
+
+    def close(self):
+        self.rotate()
+
+
+class PlayerCache:
+    # Players that sent commands recently are kept in memory, so the player state of a command costs no query.
+    # Fields written by the background journey scheduler (location, hp) are write-behind: they change in memory,
+    # go to the journal, and reach SQLite in one batched transaction per shard every flush_interval seconds, when
+    # max_dirty persons are waiting, and at shutdown. Money is changed together with person_item rows, so it stays
+    # in those transactions and is never deferred.
+    def __init__(self, dao, size=config.PLAYER_CACHE_SIZE, flush_interval=config.PLAYER_CACHE_FLUSH_SECONDS,
+                 max_dirty=config.PLAYER_CACHE_MAX_DIRTY, journal=config.PLAYER_CACHE_JOURNAL,
+                 fsync=config.PLAYER_CACHE_FSYNC):
+        self.dao = dao
+        self.size = size
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.journal = PlayerJournal(journal or f'{config.GAME_DATABASE}.players', fsync)
+        self.dirty: Dict[int, dict] = {}
+        self._persons: 'OrderedDict[str, PersonRecord]' = OrderedDict()
+        self._by_id: Dict[int, PersonRecord] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_needed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._persons.clear()
+        self._by_id.clear()
+        self.dirty = self.journal.replay()
+        if self.dirty:
+            logger.info('Replaying %s journaled player changes', len(self.dirty))
+            await self.flush()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        self.journal.close()
+
+    def get(self, external_id) -> Optional[PersonRecord]:
+        person = self._persons.get(external_id)
+        metrics.PLAYER_CACHE_LOOKUPS.inc('hit' if person is not None else 'miss')
+        if person is not None:
+            self._persons.move_to_end(external_id)
+        return person
+
+    def put(self, person: PersonRecord) -> PersonRecord:
+        for name, value in self.dirty.get(person.id, {}).items():
+            setattr(person, name, value)
+        previous = self._persons.pop(person.external_id, None)
+        if previous is not None:
+            self._by_id.pop(previous.id, None)
+        self._persons[person.external_id] = person
+        self._by_id[person.id] = person
+        while len(self._persons) > self.size:
+            _, evicted = self._persons.popitem(last=False)
+            self._by_id.pop(evicted.id, None)
+        return person
+
+    def invalidate(self, external_id):
+        # Dirty fields are kept apart from the cached objects, dropping an object never loses a change.
+        person = self._persons.pop(external_id, None)
+        if person is not None:
+            self._by_id.pop(person.id, None)
+
+    def record(self, changes: Dict[int, dict]):
+        if not changes:
+            return
+        self.journal.append(changes)
+        for person_id, fields in changes.items():
+            self.dirty.setdefault(person_id, {}).update(fields)
+            person = self._by_id.get(person_id)
+            if person is not None:
+                for name, value in fields.items():
+                    setattr(person, name, value)
+        if len(self.dirty) >= self.max_dirty:
+            self._flush_needed.set()
+
+    def record_arrivals(self, arrivals: Iterable):
+        changes = {}
+        for arrival in arrivals:
+            if self.location_id(arrival.person_id) not in (None, arrival.from_location_id):
+                continue
+            changes[arrival.person_id] = dict(location_id=arrival.to_location_id)
+            if arrival.restores_hp:
+                changes[arrival.person_id]['hp'] = 100
+        self.record(changes)
+
+    def location_id(self, person_id) -> Optional[int]:
+        if 'location_id' in self.dirty.get(person_id, {}):
+            return self.dirty[person_id]['location_id']
+        person = self._by_id.get(person_id)
+        return person.location_id if person is not None else None
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self.dirty:
+                return 0
+            dirty, self.dirty = self.dirty, {}
+            segment = self.journal.rotate()
+            try:
+                with metrics.PLAYER_CACHE_FLUSH_SECONDS.time():
+                    await self.dao.update_persons(dirty)
+            except BaseException:
+                for person_id, fields in dirty.items():
+                    self.dirty[person_id] = {**fields, **self.dirty.get(person_id, {})}
+                raise
+            self.journal.discard(segment)
+            metrics.PLAYER_CACHE_FLUSHED.inc(amount=len(dirty))
+            return len(dirty)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Failed to flush player changes, they stay in the journal')
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Dict, Optional
+
+import config
+import metrics
+
+
+class Mailbox:
+    def __init__(self, owner: 'PlayerMailboxes', key):
+        self.owner = owner
+        self.key = key
+        self.depth = 0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        # asyncio.Lock wakes its waiters in arrival order, so the player's updates run in the order they came.
+        try:
+            with metrics.MAILBOX_WAIT_SECONDS.time():
+                await self._lock.acquire()
+        except BaseException:
+            self._leave()
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._lock.release()
+        self._leave()
+
+    def _leave(self):
+        self.depth -= 1
+        if not self.depth:
+            del self.owner.mailboxes[self.key]
+
+
+class PlayerMailboxes:
+    def __init__(self, max_depth=config.MAILBOX_MAX_DEPTH):
+        self.max_depth = max_depth
+        self.mailboxes: Dict[int, Mailbox] = {}
+
+    def enter(self, key) -> Optional[Mailbox]:
+        # Returns None when the player already has max_depth updates running or waiting: the update is shed.
+        # A mailbox lives only while it has updates, so idle players cost nothing.
+        mailbox = self.mailboxes.get(key)
+        if mailbox is None:
+            mailbox = self.mailboxes[key] = Mailbox(self, key)
+        elif mailbox.depth >= self.max_depth:
+            return None
+        mailbox.depth += 1
+        return mailbox
@@ -0,0 +1,33 @@
+from typing import Optional
+
+from dto import Item, Person
+
+PERSON_COLUMNS = tuple(column.name for column in Person.__table__.columns)
+
+
+class PersonRecord:
+    # Plain attributes in column order, read by Core statements without an identity map. The engine changes them
+    # in place, PlayerCache keeps them between updates.
+    __slots__ = PERSON_COLUMNS
+
+    def __init__(self, *values):
+        for name, value in zip(PERSON_COLUMNS, values):
+            setattr(self, name, value)
+
+    @staticmethod
+    def of(person: Person) -> 'PersonRecord':
+        return PersonRecord(*(getattr(person, name) for name in PERSON_COLUMNS))
+
+
+class OwnedItem:
+    # A person_item row with its item taken from WorldCatalog, so the item table is never read per update.
+    __slots__ = ('item', 'quantity', 'put_on')
+
+    def __init__(self, item: Optional[Item], quantity, put_on):
+        self.item = item
+        self.quantity = quantity
+        self.put_on = put_on
+
+    @property
+    def item_id(self):
+        return self.item.id
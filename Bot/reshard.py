@@ -0,0 +1,167 @@
+import argparse
+import os
+import sqlite3
+from contextlib import closing
+from itertools import islice
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine
+
+import config
+from dto import PLAYER_TABLES, Person
+from init_db import database_name
+from migrate_db import migrate
+from player_cache import PlayerJournal
+from sharding import next_person_id, shard_databases, shard_of_player
+
+
+class Resharder:
+    # Moves the player tables from `from_shards` files (1 is the plain game.db) to `to_shards` files. New shard files
+    # are written next to their final names and renamed only when everything is copied. Person ids are renumbered
+    # so that every id maps to its shard; rows of the other player tables follow their person.
+    def __init__(self, database=database_name, from_shards=config.SHARD_COUNT, to_shards=2, chunk_size=50_000):
+        if from_shards == to_shards:
+            raise ValueError(f'the database already has {to_shards} shards')
+        self.database = database
+        self.sources = shard_databases(database, from_shards)
+        self.targets = shard_databases(database, to_shards)
+        self.to_shards = to_shards
+        self.chunk_size = chunk_size
+        self.copied: Dict[str, int] = {table.name: 0 for table in PLAYER_TABLES}
+        self.orphans = 0
+
+    def reshard(self):
+        if PlayerJournal(config.PLAYER_CACHE_JOURNAL or f'{self.database}.players').segments():
+            # Journaled changes name persons by id, and ids are renumbered here.
+            raise RuntimeError('the bot did not stop cleanly, start and stop it once to write its player journal')
+        if len(self.sources) == 1:
+            self._migrate(self.database, None)
+
+        staged = [self._stage(target) for target in self.targets]
+        connections = [sqlite3.connect(path) for path in staged]
+        try:
+            for path, connection in zip(staged, connections):
+                if path == self.database:
+                    # Back to one file: game.db keeps the world and its player tables are refilled in one transaction.
+                    self._clear(connection)
+            next_ids: List[Optional[int]] = [None] * self.to_shards
+            for source in self.sources:
+                with closing(sqlite3.connect(source)) as connection:
+                    person_ids = self._copy_persons(connection, connections, next_ids)
+                    for table in PLAYER_TABLES:
+                        if table is not Person.__table__:
+                            self._copy_rows(connection, connections, table, person_ids)
+            for connection in connections:
+                connection.commit()
+        finally:
+            for connection in connections:
+                connection.close()
+
+        self._publish(staged)
+
+    def _stage(self, target) -> str:
+        if target == self.database:
+            return target
+
+        staged = f'{target}.new'
+        for path in (staged, f'{staged}-wal', f'{staged}-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+        self._migrate(staged, PLAYER_TABLES)
+        return staged
+
+    def _copy_persons(self, source, targets, next_ids) -> Dict[int, int]:
+        columns = [column.name for column in Person.__table__.columns]
+        id_index, external_id_index = columns.index('id'), columns.index('external_id')
+        person_ids = {}
+        rows = source.execute(f'SELECT {", ".join(columns)} FROM person ORDER BY id')
+        batches = [[] for _ in targets]
+        for row in rows:
+            row = list(row)
+            shard = shard_of_player(row[external_id_index], self.to_shards)
+            if self.to_shards > 1:
+                next_ids[shard] = next_person_id(next_ids[shard], shard, self.to_shards)
+                person_ids[row[id_index]] = row[id_index] = next_ids[shard]
+            else:
+                next_ids[0] = (next_ids[0] or 0) + 1
+                person_ids[row[id_index]] = row[id_index] = next_ids[0]
+            batches[shard].append(row)
+            if len(batches[shard]) >= self.chunk_size:
+                self._insert(targets[shard], Person.__table__.name, columns, batches[shard])
+                batches[shard] = []
+        for target, batch in zip(targets, batches):
+            self._insert(target, Person.__table__.name, columns, batch)
+        return person_ids
+
+    def _copy_rows(self, source, targets, table, person_ids):
+        # Surrogate ids of these tables are local to a shard and are given out again by the target.
+        columns = [column.name for column in table.columns if column.name != 'id']
+        person_index = columns.index('person_id')
+        rows = source.execute(f'SELECT {", ".join(columns)} FROM {table.name} ORDER BY rowid')
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            batches = [[] for _ in targets]
+            for row in chunk:
+                person_id = person_ids.get(row[person_index])
+                if person_id is None:
+                    self.orphans += 1
+                    continue
+                row = list(row)
+                row[person_index] = person_id
+                batches[person_id % self.to_shards].append(row)
+            for target, batch in zip(targets, batches):
+                self._insert(target, table.name, columns, batch)
+
+    def _insert(self, connection, table, columns, rows):
+        if rows:
+            connection.executemany(
+                f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})', rows,
+            )
+            self.copied[table] += len(rows)
+
+    def _publish(self, staged):
+        # Players now live in exactly one place: old shard files become .bak, game.db's own player tables are emptied.
+        for source in self.sources:
+            if source != self.database:
+                os.replace(source, f'{source}.bak')
+            elif source not in self.targets:
+                with closing(sqlite3.connect(source)) as connection:
+                    self._clear(connection)
+                    connection.commit()
+        for path, target in zip(staged, self.targets):
+            if path != target:
+                for suffix in ('-wal', '-shm'):
+                    if os.path.exists(target + suffix):
+                        os.remove(target + suffix)
+                os.replace(path, target)
+
+    @staticmethod
+    def _clear(connection):
+        for table in reversed(PLAYER_TABLES):
+            connection.execute(f'DELETE FROM {table.name}')
+
+    @staticmethod
+    def _migrate(database, tables):
+        engine = create_engine(f'sqlite+pysqlite:///{database}')
+        with engine.begin() as connection:
+            migrate(connection, tables)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Splits the players of game.db across SQLite shard files.')
+    parser.add_argument('--shards', type=int, required=True, help='new number of shards, 1 moves players to game.db')
+    parser.add_argument('--from-shards', type=int, default=config.SHARD_COUNT, help='current number of shards')
+    parser.add_argument('--database', default=database_name)
+    args = parser.parse_args()
+
+    started = perf_counter()
+    resharder = Resharder(args.database, args.from_shards, args.shards)
+    resharder.reshard()
+    print(f'Copied {resharder.copied} into {", ".join(resharder.targets)} in {perf_counter() - started:.1f}s')
+    if resharder.orphans:
+        print(f'Skipped {resharder.orphans} rows of persons that no longer exist')
+    print(f'Set SHARD_COUNT={args.shards} before starting the bot.')
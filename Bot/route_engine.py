@@ -0,0 +1,167 @@
+import asyncio
+import heapq
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+import config
+
+UNREACHABLE = np.iinfo(np.int32).max
+
+# Reversed edges of the world in the search processes, set once per process by _load_graph.
+_graph = None
+
+
+def _load_graph(offsets, sources, weights):
+    global _graph
+    _graph = (offsets.tolist(), sources.tolist(), weights.tolist())
+
+
+def _search(target) -> np.ndarray:
+    # Dijkstra over reversed edges from the target: the parent of a node is its next hop towards the target.
+    offsets, sources, weights = _graph
+    n = len(offsets) - 1
+    distances = [UNREACHABLE] * n
+    parents = [-1] * n
+    distances[target] = 0
+    parents[target] = target
+    queue = [(0, target)]
+    while queue:
+        distance, node = heapq.heappop(queue)
+        if distance > distances[node]:
+            continue
+        for edge in range(offsets[node], offsets[node + 1]):
+            neighbour = sources[edge]
+            candidate = distance + weights[edge]
+            if candidate < distances[neighbour]:
+                distances[neighbour] = candidate
+                parents[neighbour] = node
+                heapq.heappush(queue, (candidate, neighbour))
+    return np.asarray(parents, dtype=np.int32)
+
+
+class RouteEngine:
+    # Worlds up to max_dense_locations get all-pairs next hops at build time. Larger ones are searched per target
+    # in worker processes, so a search never holds the event loop or its GIL. At most max_searches targets are
+    # searched or queued at once and a query waits search_timeout seconds at most: then it raises
+    # asyncio.TimeoutError, while the search goes on and its row is cached for the next query.
+    def __init__(self, max_dense_locations=config.ROUTE_MAX_DENSE_LOCATIONS, cache_size=config.ROUTE_CACHE_SIZE,
+                 workers=config.ROUTE_SEARCH_WORKERS, max_searches=config.ROUTE_MAX_SEARCHES,
+                 search_timeout=config.ROUTE_SEARCH_TIMEOUT):
+        self.max_dense_locations = max_dense_locations
+        self.cache_size = cache_size
+        self.workers = workers
+        self.max_searches = max_searches
+        self.search_timeout = search_timeout
+        self.location_ids = np.empty(0, dtype=np.int64)
+        self._index: Dict[int, int] = {}
+        self._next_hops: Optional[np.ndarray] = None
+        self._graph = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._searches: Dict[int, asyncio.Future] = {}
+        self._rows: OrderedDict = OrderedDict()
+
+    def build(self, location_ids: Iterable[int], sources: np.ndarray, targets: np.ndarray, weights: np.ndarray):
+        self.close()
+        self.location_ids = np.sort(np.fromiter(location_ids, dtype=np.int64))
+        self._index = {location_id: i for i, location_id in enumerate(self.location_ids.tolist())}
+        self._rows = OrderedDict()
+
+        n = len(self.location_ids)
+        sources = np.searchsorted(self.location_ids, np.asarray(sources, dtype=np.int64))
+        targets = np.searchsorted(self.location_ids, np.asarray(targets, dtype=np.int64))
+        weights = np.asarray(weights, dtype=np.int64)
+
+        if n <= self.max_dense_locations:
+            self._build_dense(n, sources, targets, weights)
+        else:
+            self._build_sparse(n, sources, targets, weights)
+
+    def close(self):
+        # Searches of the previous world are dropped with their processes.
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._searches = {}
+
+    async def route(self, from_location_id, to_location_id) -> Optional[List[int]]:
+        source = self._index.get(int(from_location_id))
+        target = self._index.get(int(to_location_id))
+        if source is None or target is None:
+            return None
+
+        if self._next_hops is not None:
+            if self._next_hops[source, target] < 0:
+                return None
+            next_hops = self._next_hops[:, target]
+        else:
+            next_hops = await self._sparse_row(target)
+            if next_hops[source] < 0:
+                return None
+
+        route = [source]
+        while route[-1] != target:
+            route.append(int(next_hops[route[-1]]))
+        return [int(self.location_ids[i]) for i in route]
+
+    def _build_dense(self, n, sources, targets, weights):
+        infinity = np.int32(UNREACHABLE // 2)
+        distances = np.full((n, n), infinity, dtype=np.int32)
+        next_hops = np.full((n, n), -1, dtype=np.int32 if n > np.iinfo(np.int16).max else np.int16)
+        np.minimum.at(distances, (sources, targets), np.minimum(weights, infinity).astype(np.int32))
+        next_hops[sources, targets] = targets
+        diagonal = np.arange(n)
+        distances[diagonal, diagonal] = 0
+        next_hops[diagonal, diagonal] = diagonal
+
+        via = np.empty_like(distances)
+        better = np.empty((n, n), dtype=bool)
+        for k in range(n):
+            np.add(distances[:, k, None], distances[None, k, :], out=via)
+            np.less(via, distances, out=better)
+            np.copyto(distances, via, where=better)
+            np.copyto(next_hops, next_hops[:, k, None], where=better)
+
+        self._next_hops = next_hops
+        self._graph = None
+
+    def _build_sparse(self, n, sources, targets, weights):
+        # Reversed edges in CSR form: the edges into node i are sources[offsets[i]:offsets[i + 1]].
+        order = np.argsort(targets, kind='stable')
+        self._next_hops = None
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(targets, minlength=n))))
+        self._graph = (offsets, sources[order], weights[order])
+
+    async def _sparse_row(self, target) -> np.ndarray:
+        row = self._rows.get(target)
+        if row is not None:
+            self._rows.move_to_end(target)
+            return row
+
+        search = self._searches.get(target)
+        if search is None:
+            if len(self._searches) >= self.max_searches:
+                raise asyncio.TimeoutError()
+            if self._pool is None:
+                # Spawned, not forked: the bot process runs database threads.
+                self._pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'),
+                                                 initializer=_load_graph, initargs=self._graph)
+            searches = self._searches
+            search = asyncio.get_running_loop().run_in_executor(self._pool, _search, target)
+            search.add_done_callback(lambda done: self._searched(searches, target, done))
+            searches[target] = search
+        return await asyncio.wait_for(asyncio.shield(search), self.search_timeout)
+
+    def _searched(self, searches, target, search: asyncio.Future):
+        if searches is not self._searches:
+            # The world was rebuilt meanwhile.
+            return
+        del searches[target]
+        if search.cancelled() or search.exception() is not None:
+            return
+        self._rows[target] = search.result()
+        if len(self._rows) > self.cache_size:
+            self._rows.popitem(last=False)
@@ -0,0 +1,32 @@
+import os
+import zlib
+from typing import List, Optional
+
+import config
+
+
+def shard_databases(database=config.GAME_DATABASE, shard_count=config.SHARD_COUNT,
+                    pattern=config.SHARD_DATABASE) -> List[str]:
+    # Player shards live next to the world database: game.db -> game.shard0.db, game.shard1.db, ...
+    if shard_count <= 1:
+        return [database]
+    if not pattern:
+        root, extension = os.path.splitext(database)
+        pattern = f'{root}.shard{{}}{extension}'
+    return [pattern.format(shard) for shard in range(shard_count)]
+
+
+def shard_of_player(external_id, shard_count) -> int:
+    # crc32, not hash(): str hashes are salted per process and a player must land on the same shard every time.
+    return zlib.crc32(str(external_id).encode()) % shard_count
+
+
+def shard_of_person(person_id, shard_count) -> int:
+    return int(person_id) % shard_count
+
+
+def next_person_id(max_id: Optional[int], shard, shard_count) -> int:
+    # Person ids of a shard are congruent to the shard number, so a person id alone is enough to find its shard.
+    if max_id is None:
+        return shard or shard_count
+    return (max_id // shard_count + 1) * shard_count + shard
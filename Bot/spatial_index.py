@@ -0,0 +1,70 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+def neighbour_pairs(xs: np.ndarray, ys: np.ndarray, max_distance):
+    # Locations are bucketed into max_distance x max_distance cells, so every neighbour lies in one of 9 cells.
+    n = len(xs)
+    cell = max(int(max_distance), 1)
+    cx, cy = xs // cell + 1, ys // cell + 1
+    width = int(cy.max(initial=0)) + 2
+    keys = cx * width + cy
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    sources, targets = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbour_keys = keys + dx * width + dy
+            start = np.searchsorted(sorted_keys, neighbour_keys, side='left')
+            counts = np.searchsorted(sorted_keys, neighbour_keys, side='right') - start
+            total = int(counts.sum())
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            sources.append(np.repeat(np.arange(n), counts))
+            targets.append(order[np.repeat(start, counts) + offsets])
+
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+    distances = np.abs(xs[sources] - xs[targets]) + np.abs(ys[sources] - ys[targets])
+    mask = (sources != targets) & (distances <= max_distance)
+    sources, targets, distances = sources[mask], targets[mask], distances[mask]
+    order = np.lexsort((targets, sources))
+    return sources[order], targets[order], distances[order]
+
+
+class SpatialGrid:
+    def __init__(self, cell_size):
+        self.cell_size = max(int(cell_size), 1)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.xs = np.empty(0, dtype=np.int64)
+        self.ys = np.empty(0, dtype=np.int64)
+        self._cells: Dict[Tuple[int, int], List[Tuple[int, int, int]]] = {}
+
+    def build(self, locations: Iterable[Tuple[int, int, int]]):
+        self._cells = defaultdict(list)
+        ids, xs, ys = [], [], []
+        for location_id, x, y in locations:
+            self._cells[(x // self.cell_size, y // self.cell_size)].append((location_id, x, y))
+            ids.append(location_id)
+            xs.append(x)
+            ys.append(y)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.xs = np.asarray(xs, dtype=np.int64)
+        self.ys = np.asarray(ys, dtype=np.int64)
+
+    def within(self, x, y, distance) -> List[Tuple[int, int]]:
+        found = []
+        for cx in range((x - distance) // self.cell_size, (x + distance) // self.cell_size + 1):
+            for cy in range((y - distance) // self.cell_size, (y + distance) // self.cell_size + 1):
+                for location_id, lx, ly in self._cells.get((cx, cy), ()):
+                    location_distance = abs(lx - x) + abs(ly - y)
+                    if location_distance <= distance:
+                        found.append((location_id, location_distance))
+        found.sort()
+        return found
+
+    def pairs(self, distance) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        sources, targets, distances = neighbour_pairs(self.xs, self.ys, distance)
+        return self.ids[sources], self.ids[targets], distances
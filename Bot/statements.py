@@ -0,0 +1,157 @@
+from functools import lru_cache
+from typing import Dict, Tuple
+
+from sqlalchemy import and_, bindparam, delete, desc, not_, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.future import select
+
+from dto import ITEM_BONUS_PROPERTIES, ActiveJourney, Journey, Person, PersonItem
+
+
+class Statement:
+    # A statement built once at import. Values are bound parameters, so every call reuses the same object, its
+    # memoized cache key and the compiled SQL. `sample` are parameters that match no row, used by the warm-up.
+    def __init__(self, name, statement, sample, write=False):
+        self.name = name
+        self.statement = statement
+        self.sample = sample
+        self.write = write
+
+
+REGISTRY: Dict[str, Statement] = {}
+
+
+def prebuilt(name, statement, sample, write=False):
+    REGISTRY[name] = Statement(name, statement, sample, write)
+    return statement
+
+
+def _ids(name):
+    return bindparam(name, expanding=True)
+
+
+# Hot reads select plain columns: rows come back as tuples, with no identity map and no relationship loading.
+PLAYER = prebuilt('player', select(Person.__table__)
+                  .where(Person.external_id == bindparam('external_id'))
+                  .order_by(desc(Person.id))
+                  .limit(1), dict(external_id=''))
+
+_owned_items = select(PersonItem.item_id, PersonItem.quantity, PersonItem.put_on)
+
+PERSON_ITEM = prebuilt('person_item', _owned_items
+                       .where(and_(PersonItem.person_id == bindparam('person_id'),
+                                   PersonItem.item_id == bindparam('item_id'))), dict(person_id=0, item_id=0))
+
+ITEMS = prebuilt('items', _owned_items
+                 .where(PersonItem.person_id == bindparam('person_id'))
+                 .order_by(desc(PersonItem.put_on)), dict(person_id=0))
+
+WORN_ITEMS = prebuilt('worn_items', _owned_items
+                      .where(and_(PersonItem.person_id == bindparam('person_id'), PersonItem.put_on)), dict(person_id=0))
+
+_items_page = _owned_items.where(PersonItem.person_id == bindparam('person_id'))
+ITEMS_FIRST_PAGE = prebuilt('items_first_page', _items_page
+                            .order_by(PersonItem.item_id)
+                            .limit(bindparam('limit')), dict(person_id=0, limit=1))
+ITEMS_NEXT_PAGE = prebuilt('items_next_page', _items_page
+                           .where(PersonItem.item_id > bindparam('key'))
+                           .order_by(PersonItem.item_id)
+                           .limit(bindparam('limit')), dict(person_id=0, key=0, limit=1))
+ITEMS_PREVIOUS_PAGE = prebuilt('items_previous_page', _items_page
+                               .where(PersonItem.item_id < bindparam('key'))
+                               .order_by(desc(PersonItem.item_id))
+                               .limit(bindparam('limit')), dict(person_id=0, key=0, limit=1))
+
+# Names of columns are reserved for the SET clause of an update, so these binds are prefixed.
+_person_item = and_(PersonItem.person_id == bindparam('b_person_id'), PersonItem.item_id == bindparam('b_item_id'))
+
+SET_PUT_ON = prebuilt('set_put_on', update(PersonItem)
+                      .where(and_(_person_item, PersonItem.put_on != bindparam('new_put_on')))
+                      .values(put_on=bindparam('new_put_on')), dict(b_person_id=0, b_item_id=0, new_put_on=True), write=True)
+
+ADD_BONUSES = prebuilt('add_bonuses', update(Person)
+                       .where(Person.id == bindparam('person_id'))
+                       .values({
+                           getattr(Person, f'bonus_{name}'): getattr(Person, f'bonus_{name}') + bindparam(f'add_{name}')
+                           for name in ITEM_BONUS_PROPERTIES
+                       }), dict(person_id=0, **{f'add_{name}': 0 for name in ITEM_BONUS_PROPERTIES}), write=True)
+
+CHARGE = prebuilt('charge', update(Person)
+                  .where(and_(Person.id == bindparam('person_id'), Person.money >= bindparam('cost')))
+                  .values(money=Person.money - bindparam('cost')), dict(person_id=0, cost=0), write=True)
+
+PAY = prebuilt('pay', update(Person)
+               .where(Person.id == bindparam('person_id'))
+               .values(money=Person.money + bindparam('gain')), dict(person_id=0, gain=0), write=True)
+
+# Executed with one parameter set per item, so carts of any size share one statement.
+_add_items = insert(PersonItem)
+ADD_ITEMS = prebuilt('add_items', _add_items.on_conflict_do_update(
+    index_elements=[PersonItem.person_id, PersonItem.item_id],
+    set_=dict(quantity=PersonItem.quantity + _add_items.excluded.quantity),
+), [dict(person_id=0, item_id=0, quantity=0, put_on=False)], write=True)
+
+TAKE_ITEMS = prebuilt('take_items', update(PersonItem)
+                      .where(and_(_person_item, PersonItem.quantity >= bindparam('taken')))
+                      .values(quantity=PersonItem.quantity - bindparam('taken')),
+                      dict(b_person_id=0, b_item_id=0, taken=0), write=True)
+
+_sold_out = and_(_person_item, PersonItem.quantity == 0)
+SOLD_OUT_PUT_ON = prebuilt('sold_out_put_on', select(PersonItem.put_on)
+                           .where(_sold_out), dict(b_person_id=0, b_item_id=0))
+DELETE_SOLD_OUT = prebuilt('delete_sold_out', delete(PersonItem)
+                           .where(_sold_out), dict(b_person_id=0, b_item_id=0), write=True)
+
+PENDING_JOURNEYS = prebuilt('pending_journeys', select(ActiveJourney)
+                            .where(not_(ActiveJourney.arrived)), dict())
+
+_arrived = and_(ActiveJourney.person_id.in_(_ids('person_ids')), ActiveJourney.arrived)
+ARCHIVE_ARRIVED = prebuilt('archive_arrived', insert(Journey).from_select(
+    [Journey.person_id, Journey.from_location_id, Journey.to_location_id, Journey.departed_at, Journey.arrive_by],
+    select(
+        ActiveJourney.person_id,
+        ActiveJourney.from_location_id,
+        ActiveJourney.to_location_id,
+        ActiveJourney.departed_at,
+        ActiveJourney.arrive_by,
+    ).where(_arrived),
+), dict(person_ids=[0]), write=True)
+DELETE_ARRIVED = prebuilt('delete_arrived', delete(ActiveJourney)
+                          .where(_arrived)
+                          .execution_options(synchronize_session=False), dict(person_ids=[0]), write=True)
+
+# Executed with one parameter set per arrival. Only the journey that arrived is marked, not one started since.
+MARK_ARRIVED = prebuilt('mark_arrived', update(ActiveJourney)
+                        .where(and_(ActiveJourney.person_id == bindparam('b_person_id'),
+                                    ActiveJourney.arrive_by == bindparam('b_arrive_by')))
+                        .values(arrived=True)
+                        .execution_options(synchronize_session=False), [dict(b_person_id=0, b_arrive_by=0)],
+                        write=True)
+
+# Executed with one parameter set per journey.
+_start_journey = insert(ActiveJourney)
+START_JOURNEY = prebuilt('start_journey', _start_journey.on_conflict_do_update(
+    index_elements=[ActiveJourney.person_id],
+    set_=dict(
+        from_location_id=_start_journey.excluded.from_location_id,
+        to_location_id=_start_journey.excluded.to_location_id,
+        departed_at=_start_journey.excluded.departed_at,
+        arrive_by=_start_journey.excluded.arrive_by,
+        remaining_route=_start_journey.excluded.remaining_route,
+        arrived=False,
+    ),
+), [dict(person_id=0, from_location_id=0, to_location_id=0, departed_at=0, arrive_by=0, remaining_route=None,
+         arrived=False)], write=True)
+
+
+@lru_cache(maxsize=None)
+def update_person_fields(fields: Tuple[str, ...]):
+    # Write-behind flushes change a few field sets (location, location and hp), one statement per set.
+    return update(Person.__table__)\
+        .where(Person.__table__.c.id == bindparam('person_id'))\
+        .values({name: bindparam(f'new_{name}') for name in fields})
+
+
+for _fields in (('location_id',), ('hp', 'location_id')):
+    prebuilt(f'update_person_{"_".join(_fields)}', update_person_fields(_fields),
+             [dict(person_id=0, **{f'new_{name}': 0 for name in _fields})], write=True)
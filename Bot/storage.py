@@ -0,0 +1,98 @@
+from contextlib import AsyncExitStack
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import config
+import metrics
+
+
+def attach_read_only(database, schema='world') -> str:
+    return f"ATTACH DATABASE '{Path(database).resolve().as_uri()}?mode=ro' AS {schema}"
+
+
+class StorageProfile:
+    def __init__(
+        self,
+        journal_mode=config.SQLITE_JOURNAL_MODE,
+        synchronous=config.SQLITE_SYNCHRONOUS,
+        mmap_size=config.SQLITE_MMAP_SIZE,
+        cache_size=config.SQLITE_CACHE_SIZE,
+        busy_timeout=config.SQLITE_BUSY_TIMEOUT,
+        read_pool_size=config.SQLITE_READ_POOL_SIZE,
+    ):
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self.read_pool_size = read_pool_size
+
+    def pragmas(self, read_only):
+        pragmas = [
+            f'PRAGMA busy_timeout = {int(self.busy_timeout)}',
+            f'PRAGMA synchronous = {self.synchronous}',
+            f'PRAGMA mmap_size = {int(self.mmap_size)}',
+            f'PRAGMA cache_size = {int(self.cache_size)}',
+        ]
+        if read_only:
+            pragmas.append('PRAGMA query_only = ON')
+        else:
+            # The journal mode is stored in the database file, only the writer changes it. A read-only tool that
+            # never writes leaves the file as it found it.
+            pragmas.insert(1, f'PRAGMA journal_mode = {self.journal_mode}')
+        return pragmas
+
+
+class SqliteStore:
+    # With `attach` every connection also sees that database, read-only, under the schema name `world`. SQLite
+    # resolves unqualified table names in main first, so a shard file holding only player tables can still join
+    # them with the world tables.
+    def __init__(self, database_name, profile: Optional[StorageProfile] = None, attach=None, name=''):
+        self.database_name = database_name
+        self.attach = attach
+        self.name = name
+        self.profile = profile or StorageProfile()
+        self.read_engine = self._create_engine(database_name, self.profile.read_pool_size, read_only=True)
+        self.write_engine = self._create_engine(database_name, 1, read_only=False)
+        self.ReadSession = sessionmaker(self.read_engine, expire_on_commit=False, class_=AsyncSession)
+        self.WriteSession = sessionmaker(self.write_engine, expire_on_commit=False, class_=AsyncSession)
+
+    async def open_connections(self):
+        # Fills both pools, every connection runs its pragmas and ATTACH now instead of during an update.
+        # The writer comes first, it sets the journal mode before the readers open the file.
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(self.write_engine.connect())
+            for _ in range(self.profile.read_pool_size):
+                await stack.enter_async_context(self.read_engine.connect())
+
+    async def dispose(self):
+        await self.read_engine.dispose()
+        await self.write_engine.dispose()
+
+    def _create_engine(self, database_name, pool_size, read_only):
+        engine = create_async_engine(
+            f'sqlite+aiosqlite:///{database_name}',
+            echo=False,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=pool_size,
+            max_overflow=0,
+        )
+        pragmas = self.profile.pragmas(read_only)
+        if self.attach:
+            pragmas.append(attach_read_only(self.attach))
+        label = 'read' if read_only else 'write'
+        metrics.instrument_engine(engine.sync_engine, f'{self.name}:{label}' if self.name else label)
+
+        @event.listens_for(engine.sync_engine, 'connect')
+        def _apply_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+        return engine
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+# Modules of the bot are flat and imported by name, as main.py does from its own directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dto import meta  # noqa: E402
+from init_db import GameDataInitializer  # noqa: E402
+
+
+@pytest.fixture
+def game_db(tmp_path, monkeypatch):
+    # A fresh 40-location world in game.db of a temporary working directory. The default database, shard and
+    # journal paths are relative, so the bot's modules use it as they are.
+    monkeypatch.chdir(tmp_path)
+    engine = create_engine('sqlite+pysqlite:///game.db')
+    meta.create_all(engine)
+    GameDataInitializer(engine, seed=1).generate_world()
+    engine.dispose()
+    return tmp_path / 'game.db'
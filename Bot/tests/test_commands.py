@@ -0,0 +1,33 @@
+from commands import CommandSchema, integer, word
+
+CART = CommandSchema(integer('item_id'), integer('quantity'), repeated=True)
+
+
+def test_fixed_arguments():
+    schema = CommandSchema(word('nickname'), integer('location_id'))
+    assert schema.parse(' hero 12 ') == ('hero', 12)
+    assert schema.parse('hero') is None
+    assert schema.parse('hero 12 13') is None
+
+
+def test_repeated_pairs():
+    assert CART.parse('1 2') == ([(1, 2)],)
+    assert CART.parse('  1 2   3 4 ') == ([(1, 2), (3, 4)],)
+
+
+def test_repeated_rejects_odd_count():
+    assert CART.parse('1') is None
+    assert CART.parse('1 2 3') is None
+    assert CART.parse('') is None
+
+
+def test_repeated_rejects_run_together_values():
+    # Without whitespace between repetitions "1 2345 6" used to be read as "1 234" + "5 6".
+    assert CART.parse('1 2345 6') is None
+    assert CART.parse('1 23 4') is None
+
+
+def test_repeated_single_argument():
+    schema = CommandSchema(integer('item_id'), repeated=True)
+    assert schema.parse('1 22 333') == ([(1,), (22,), (333,)],)
+    assert schema.parse('1 2x') is None
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+from contextlib import closing
+
+from dto import ITEM_BONUS_PROPERTIES
+from game_async_engine import GameAsyncEngine
+
+BOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BONUS_COLUMNS = ', '.join(f'bonus_{name}' for name in ITEM_BONUS_PROPERTIES)
+
+
+async def create_players():
+    engine = GameAsyncEngine()
+    await engine.start()
+    try:
+        for external_id in ('1', '2', '3'):
+            await engine.init_person(f'p{external_id}', external_id)
+    finally:
+        await engine.stop()
+
+
+def bonuses():
+    with closing(sqlite3.connect('game.db')) as connection:
+        return {row[0]: row[1:] for row in connection.execute(f'SELECT id, {BONUS_COLUMNS} FROM person')}
+
+
+def migrate_db(*args) -> str:
+    return subprocess.run(
+        [sys.executable, os.path.join(BOT, 'migrate_db.py'), *args],
+        env={**os.environ, 'PYTHONPATH': BOT}, capture_output=True, text=True, check=True,
+    ).stdout
+
+
+def test_check_reports_and_rebuild_restores_corrupted_bonuses(game_db):
+    asyncio.run(create_players())
+    expected = bonuses()
+    assert 'game.db: 0 persons with stale bonuses' in migrate_db('--check-bonuses')
+
+    with closing(sqlite3.connect('game.db')) as connection:
+        connection.execute('UPDATE person SET bonus_attack = bonus_attack + 7 WHERE id = 1')
+        connection.execute('UPDATE person SET bonus_armour = 0, bonus_magic_armour = 99 WHERE id = 3')
+        connection.commit()
+    assert bonuses() != expected
+
+    assert 'game.db: 2 persons with stale bonuses: [1, 3]' in migrate_db('--check-bonuses')
+    assert bonuses() != expected
+
+    assert 'game.db: rebuilt bonuses of 2 persons' in migrate_db('--rebuild-bonuses')
+    assert bonuses() == expected
+    assert 'game.db: 0 persons with stale bonuses' in migrate_db('--check-bonuses')
@@ -0,0 +1,49 @@
+from cards import page_text
+from paging import Cursor, page_of_sorted
+
+
+def key(entry):
+    return entry
+
+
+def blocks(entries, width):
+    return (f'{entry:0{width - 1}d}\n' for entry in entries)
+
+
+def walk(entries, size, width, limit):
+    # Follows Next from the first page, as the buttons do, and collects what every message shows.
+    shown = []
+    cursor = None
+    while True:
+        page = page_of_sorted(entries, cursor, size, key)
+        text, count = page_text('', blocks(page.entries, width), limit)
+        page = page.cut(count)
+        shown.extend(int(line) for line in text.splitlines())
+        if page.next is None:
+            return shown
+        cursor = page.next
+
+
+def test_pages_cover_all_entries():
+    entries = list(range(1, 26))
+    assert walk(entries, size=10, width=10, limit=1000) == entries
+
+
+def test_overflowing_page_moves_next_to_first_hidden_entry():
+    entries = list(range(1, 26))
+    page = page_of_sorted(entries, None, 10, key)
+    text, count = page_text('', blocks(page.entries, 10), limit=35)
+    assert count == 3
+    assert len(text) <= 35
+    assert str(page.cut(count).next) == str(Cursor(3))
+
+
+def test_overflowing_pages_still_cover_all_entries():
+    entries = list(range(1, 26))
+    assert walk(entries, size=10, width=10, limit=35) == entries
+
+
+def test_block_longer_than_limit_is_cut_not_skipped():
+    text, count = page_text('header\n', ['x' * 50, 'y'], limit=20)
+    assert count == 1
+    assert text == 'header\n' + 'x' * 13
@@ -0,0 +1,91 @@
+import asyncio
+
+from dto import Person
+from game_dao import GameAsyncDao
+from player_cache import PlayerCache, PlayerJournal
+from records import PERSON_COLUMNS, PersonRecord
+
+
+def record(person_id, external_id, location_id=1):
+    values = dict.fromkeys(PERSON_COLUMNS, 0)
+    values.update(id=person_id, external_id=external_id, location_id=location_id, hp=100)
+    return PersonRecord(*(values[name] for name in PERSON_COLUMNS))
+
+
+async def create_player(dao) -> str:
+    await dao.create_and_get(Person(
+        nickname='crash', external_id='9', level=1, hp=100, money=250, attack=50, magic=50, magic_attack=50, xp=0,
+        armour=0, magic_armour=0, location_id=1,
+    ))
+    return '9'
+
+
+def test_journal_rotates_and_discards_closed_segments(tmp_path):
+    journal = PlayerJournal(str(tmp_path / 'players'))
+    journal.append({1: dict(location_id=2)})
+    journal.append({2: dict(location_id=3)})
+    assert journal.rotate() == 1
+    journal.append({1: dict(location_id=4, hp=100)})
+    journal.close()
+    assert [path.rsplit('.', 1)[1] for path in journal.segments()] == ['1', '2']
+
+    # The later segment wins, fields of one person are merged.
+    assert PlayerJournal(journal.path).replay() == {1: dict(location_id=4, hp=100), 2: dict(location_id=3)}
+
+    journal.discard(1)
+    assert [path.rsplit('.', 1)[1] for path in journal.segments()] == ['2']
+    assert PlayerJournal(journal.path).replay() == {1: dict(location_id=4, hp=100)}
+
+
+def test_journal_replay_stops_at_a_torn_line(tmp_path):
+    journal = PlayerJournal(str(tmp_path / 'players'))
+    journal.append({1: dict(location_id=2)})
+    journal.close()
+    with open(journal.segments()[0], 'a') as segment:
+        segment.write('{"id": 1, "locat')
+    assert PlayerJournal(journal.path).replay() == {1: dict(location_id=2)}
+
+
+def test_dirty_fields_survive_invalidate(tmp_path):
+    cache = PlayerCache(dao=None, journal=str(tmp_path / 'players'))
+    cache.put(record(7, 'seven'))
+    cache.record({7: dict(location_id=5, hp=100)})
+    cache.invalidate('seven')
+    assert cache.get('seven') is None
+
+    # The row read again from SQLite is older than the journaled change.
+    person = cache.put(record(7, 'seven', location_id=1))
+    assert person.location_id == 5
+    assert cache.location_id(7) == 5
+    cache.journal.close()
+
+
+def test_changes_journaled_before_a_crash_reach_sqlite_on_the_next_start(game_db):
+    async def crash():
+        dao = GameAsyncDao()
+        cache = PlayerCache(dao, flush_interval=3600)
+        await cache.start()
+        person = await dao.get_player(await create_player(dao))
+        cache.record({person.id: dict(location_id=person.location_id + 1, hp=55)})
+        # The process dies here: no flush, no stop, the journal is all that is left.
+        cache._task.cancel()
+        cache.journal.close()
+        await dao.dispose()
+        return person
+
+    async def restart(person):
+        dao = GameAsyncDao()
+        cache = PlayerCache(dao)
+        await cache.start()
+        try:
+            assert not cache.journal.segments()
+            stored = await dao.get_player(person.external_id)
+            assert (stored.location_id, stored.hp) == (person.location_id + 1, 55)
+        finally:
+            await cache.stop()
+            await dao.dispose()
+
+    person = asyncio.run(crash())
+    assert (person.location_id, person.hp) == (1, 100)
+    asyncio.run(restart(person))
+
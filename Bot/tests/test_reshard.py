@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+from contextlib import closing
+
+from dto import ActiveJourney, Journey
+from game_async_engine import GameAsyncEngine
+from game_dao import GameAsyncDao
+from reshard import Resharder
+from sharding import shard_databases
+
+PLAYERS = [str(external_id) for external_id in range(100, 112)]
+
+
+async def create_players():
+    engine = GameAsyncEngine()
+    await engine.start()
+    try:
+        item_ids = sorted(engine.world.items)
+        for n, external_id in enumerate(PLAYERS):
+            person = await engine.init_person(f'p{n}', external_id)
+            await engine.dao.buy_items(person.id, 50, {item_ids[n % len(item_ids)]: n + 1})
+            path = engine.world.paths_from(person.location_id)[0]
+            for arrive_by in range(n % 3):
+                await engine.dao.create_and_get(Journey(
+                    person_id=person.id, from_location_id=path.from_location_id, to_location_id=path.to_location_id,
+                    departed_at=arrive_by, arrive_by=arrive_by + path.distance,
+                ))
+            if n % 2:
+                await engine.dao.start_journey(ActiveJourney(
+                    person_id=person.id, from_location_id=path.from_location_id, to_location_id=path.to_location_id,
+                    departed_at=n, arrive_by=n + path.distance,
+                ))
+    finally:
+        await engine.stop()
+
+
+def snapshot(shard_count):
+    # Everything of every player, by external id and through person ids, as it is stored in the shard files.
+    players = {}
+    for shard, database in enumerate(shard_databases('game.db', shard_count)):
+        with closing(sqlite3.connect(database)) as connection:
+            for person_id, external_id, nickname, money in connection.execute(
+                    'SELECT id, external_id, nickname, money FROM person'):
+                assert person_id % shard_count == shard
+                assert external_id not in players
+                players[external_id] = (
+                    nickname,
+                    money,
+                    connection.execute('SELECT item_id, quantity, put_on FROM person_item WHERE person_id = ? '
+                                       'ORDER BY item_id', (person_id,)).fetchall(),
+                    connection.execute('SELECT to_location_id, arrive_by FROM journey WHERE person_id = ? '
+                                       'ORDER BY arrive_by', (person_id,)).fetchall(),
+                    connection.execute('SELECT to_location_id, arrive_by FROM active_journey WHERE person_id = ?',
+                                       (person_id,)).fetchall(),
+                )
+            for table in ('person_item', 'journey', 'active_journey'):
+                orphans = connection.execute(
+                    f'SELECT COUNT(*) FROM {table} WHERE person_id NOT IN (SELECT id FROM person)').fetchone()[0]
+                assert orphans == 0
+    return players
+
+
+async def load_players(shard_count):
+    dao = GameAsyncDao(shard_count=shard_count)
+    try:
+        pending = {journey.person_id for journey in await dao.get_pending_journeys()}
+        found = {}
+        for external_id in PLAYERS:
+            person = await dao.get_player(external_id)
+            items = await dao.get_items(person.id)
+            found[external_id] = (person.nickname, len(items), person.id in pending)
+        return found
+    finally:
+        await dao.dispose()
+
+
+def test_reshard_keeps_players_and_their_rows(game_db):
+    asyncio.run(create_players())
+    before = snapshot(1)
+    assert sorted(before) == PLAYERS
+    loaded = asyncio.run(load_players(1))
+
+    Resharder('game.db', from_shards=1, to_shards=4).reshard()
+    assert snapshot(4) == before
+    assert snapshot(1) == {}
+    assert asyncio.run(load_players(4)) == loaded
+
+    Resharder('game.db', from_shards=4, to_shards=1).reshard()
+    assert snapshot(1) == before
+    assert asyncio.run(load_players(1)) == loaded
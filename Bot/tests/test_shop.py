@@ -0,0 +1,74 @@
+import asyncio
+
+from dto import ITEM_BONUS_PROPERTIES, LocationType
+from game_async_engine import GameAsyncEngine, PlayerState
+
+
+async def started_engine():
+    engine = GameAsyncEngine()
+    await engine.start()
+    return engine
+
+
+def in_town(engine, person) -> PlayerState:
+    town = next(location for location in engine.world.locations.values()
+                if location.location_type == LocationType.TOWN)
+    return PlayerState(person, town)
+
+
+def test_concurrent_buys_never_overdraw(game_db):
+    async def scenario():
+        engine = await started_engine()
+        try:
+            person = await engine.init_person('buyer', '1')
+            first, second = [item_id for item_id in engine.world.items if item_id != engine.world.first_weapon.id][:2]
+            # 250 money: each buy fits the balance, both together do not.
+            bought = await asyncio.gather(
+                engine.dao.buy_items(person.id, 200, {first: 1}),
+                engine.dao.buy_items(person.id, 200, {second: 1}),
+            )
+            assert sorted(bought) == [False, True]
+            assert (await engine.dao.get_player('1')).money == 50
+            owned = {row.item_id for row in await engine.dao.get_items(person.id)}
+            assert len(owned & {first, second}) == 1
+        finally:
+            await engine.stop()
+
+    asyncio.run(scenario())
+
+
+def test_sell_more_than_owned_changes_nothing(game_db):
+    async def scenario():
+        engine = await started_engine()
+        try:
+            person = await engine.init_person('seller', '2')
+            weapon = engine.world.first_weapon
+            assert await engine.sell_item(in_town(engine, person), weapon.id, 2) == "don't have so many items"
+            assert (await engine.dao.get_person_item(person.id, weapon.id)).quantity == 1
+            assert (await engine.dao.get_player('2')).money == 250
+            assert person.money == 250
+        finally:
+            await engine.stop()
+
+    asyncio.run(scenario())
+
+
+def test_selling_a_worn_item_takes_off_its_bonuses(game_db):
+    async def scenario():
+        engine = await started_engine()
+        try:
+            person = await engine.init_person('wearer', '3')
+            weapon = engine.world.first_weapon
+            assert person.bonus_attack == weapon.attack
+            assert await engine.sell_item(in_town(engine, person), weapon.id, 1) is None
+
+            stored = await engine.dao.get_player('3')
+            for name in ITEM_BONUS_PROPERTIES:
+                assert getattr(person, f'bonus_{name}') == 0
+                assert getattr(stored, f'bonus_{name}') == 0
+            assert stored.money == 250 + weapon.cost_to_sale
+            assert await engine.dao.get_person_item(person.id, weapon.id) is None
+        finally:
+            await engine.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,107 @@
+import math
+from time import monotonic
+from typing import Dict, Optional
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import config
+import metrics
+
+
+def parse_costs(text) -> Dict[str, float]:
+    pairs = (pair.split('=') for pair in text.split(',') if pair.strip())
+    return {command.strip().lstrip('/'): float(cost) for command, cost in pairs}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.notified = False
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost) -> float:
+        # Seconds until `cost` tokens are there, 0 if they already are. Call refill first.
+        # A bucket with no rate is disabled.
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate) if self.rate > 0 else 0.0
+
+    def idle(self, now) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # Every command costs tokens from the sender's bucket and from the global one. A command is rejected before
+    # its handler runs, so it never reaches the engine or the database.
+    def __init__(self, user_rate=config.THROTTLE_USER_RATE, user_burst=config.THROTTLE_USER_BURST,
+                 global_rate=config.THROTTLE_GLOBAL_RATE, global_burst=config.THROTTLE_GLOBAL_BURST,
+                 costs=config.THROTTLE_COSTS, default_cost=1.0, prune_every=1000):
+        super().__init__()
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.costs = parse_costs(costs) if isinstance(costs, str) else dict(costs)
+        self.default_cost = default_cost
+        self.prune_every = prune_every
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.user_buckets: Dict[int, TokenBucket] = {}
+        self._checks = 0
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        if message.from_user is None:
+            return
+        wait = self._charge(message.from_user.id, message.get_command(pure=True) or '')
+        if wait is not None:
+            # Only the first rejected command of a burst gets an answer, a flood must not turn into a flood of replies.
+            if wait:
+                await message.reply(f'Too many commands, please try again in {math.ceil(wait)} s.')
+            raise CancelHandler()
+
+    async def on_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        # A page button costs what its listing command costs. Telegram waits for every query to be answered.
+        wait = self._charge(query.from_user.id, (query.data or '').split(':')[0])
+        if wait is not None:
+            await query.answer(f'Too many commands, please try again in {math.ceil(wait)} s.' if wait else None)
+            raise CancelHandler()
+
+    def _charge(self, user_id, command) -> Optional[float]:
+        # None if the command may run, otherwise the seconds to wait, or 0 when the player was already told.
+        cost = self.costs.get(command, self.default_cost)
+        if cost <= 0:
+            return None
+
+        now = monotonic()
+        self._checks += 1
+        if self._checks % self.prune_every == 0:
+            self._prune(now)
+
+        user_bucket = self.user_buckets.get(user_id)
+        if user_bucket is None:
+            user_bucket = self.user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        user_bucket.refill(now)
+        self.global_bucket.refill(now)
+
+        user_wait = user_bucket.wait_time(cost)
+        global_wait = self.global_bucket.wait_time(cost)
+        if not user_wait and not global_wait:
+            user_bucket.tokens -= cost
+            self.global_bucket.tokens -= cost
+            user_bucket.notified = False
+            metrics.THROTTLE_ALLOWED.inc(command)
+            return None
+
+        scope = 'user' if user_wait >= global_wait else 'global'
+        metrics.THROTTLED.inc(scope, command)
+        if user_bucket.notified:
+            return 0.0
+        user_bucket.notified = True
+        return max(user_wait, global_wait)
+
+    def _prune(self, now):
+        for user_id in [user_id for user_id, bucket in self.user_buckets.items() if bucket.idle(now)]:
+            del self.user_buckets[user_id]
@@ -0,0 +1,124 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import config
+from dto import Location, Item, ItemType, Mob, Path
+from spatial_index import SpatialGrid
+
+
+class WorldCatalog:
+    def __init__(self, paths_source=config.WORLD_PATHS, max_distance=config.PATH_MAX_DISTANCE):
+        self.paths_source = paths_source
+        self.max_distance = max_distance
+        self.paths_from_grid = paths_source == 'grid'
+        self.grid = SpatialGrid(max_distance)
+        self.loaded = False
+        self.locations: Dict[int, Location] = {}
+        self.items: Dict[int, Item] = {}
+        self.mobs: Dict[int, Mob] = {}
+        self.first_location: Optional[Location] = None
+        self.first_weapon: Optional[Item] = None
+        self._paths_by_from: Dict[int, Dict[int, int]] = {}
+        self._path_edges: Tuple[np.ndarray, ...] = ()
+        self._items_by_location_and_level: Dict[Tuple[int, int], List[Item]] = {}
+        self._item_ids_by_location: Dict[int, set] = {}
+        self._max_level = 0
+
+    async def load(self, dao):
+        locations, items, mobs, paths, items_in_locations = await dao.get_world(with_paths=self.paths_source != 'grid')
+
+        self.locations = {location.id: location for location in locations}
+        self.items = {item.id: item for item in items}
+        self.mobs = {mob.id: mob for mob in mobs}
+        self.first_location = min(locations, key=lambda x: x.id, default=None)
+
+        weapons = [item for item in items if item.req_level == 1 and item.item_type == ItemType.WEAPON]
+        self.first_weapon = min(weapons, key=lambda x: x.attack, default=None)
+
+        self.grid.build((location.id, location.x_coord, location.y_coord) for location in locations)
+        self.paths_from_grid = self.paths_source == 'grid' or (self.paths_source == 'auto' and not paths)
+        self._paths_by_from = defaultdict(dict)
+        for from_location_id, to_location_id, distance in paths:
+            self._paths_by_from[from_location_id][to_location_id] = distance
+        self._path_edges = tuple(np.asarray(column, dtype=np.int64) for column in (list(zip(*paths)) or ([], [], [])))
+
+        self._item_ids_by_location = defaultdict(set)
+        for item_in_location in items_in_locations:
+            self._item_ids_by_location[item_in_location.location_id].add(item_in_location.item_id)
+
+        self._max_level = max((item.req_level for item in items), default=0)
+        self._items_by_location_and_level = {}
+
+        self.loaded = True
+
+    def location(self, location_id) -> Optional[Location]:
+        return self.locations.get(int(location_id))
+
+    def item(self, item_id) -> Optional[Item]:
+        return self.items.get(int(item_id))
+
+    def mob(self, mob_id) -> Optional[Mob]:
+        return self.mobs.get(int(mob_id))
+
+    def mobs_of_level(self, level) -> List[Mob]:
+        return [mob for mob in self.mobs.values() if mob.req_level == level]
+
+    def paths_from(self, location_id) -> List[Path]:
+        location = self.location(location_id)
+        if location is None:
+            return []
+
+        if self.paths_from_grid:
+            destinations = self.grid.within(location.x_coord, location.y_coord, self.max_distance)
+        else:
+            destinations = self._paths_by_from.get(location.id, {}).items()
+        return [
+            self._path(location, self.locations[to_location_id], distance)
+            for to_location_id, distance in destinations if to_location_id != location.id
+        ]
+
+    def edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self.grid.pairs(self.max_distance) if self.paths_from_grid else self._path_edges
+
+    def path(self, from_location_id, to_location_id) -> Optional[Path]:
+        from_location = self.location(from_location_id)
+        to_location = self.location(to_location_id)
+        if from_location is None or to_location is None or from_location is to_location:
+            return None
+
+        if self.paths_from_grid:
+            distance = abs(from_location.x_coord - to_location.x_coord) + abs(from_location.y_coord - to_location.y_coord)
+            if distance > self.max_distance:
+                return None
+        else:
+            distance = self._paths_by_from.get(from_location.id, {}).get(to_location.id)
+            if distance is None:
+                return None
+        return self._path(from_location, to_location, distance)
+
+    def items_in_location(self, location_id, person_level) -> List[Item]:
+        key = (int(location_id), min(person_level, self._max_level))
+        items = self._items_by_location_and_level.get(key)
+        if items is None:
+            item_ids = sorted(self._item_ids_by_location.get(key[0], ()))
+            items = [self.items[item_id] for item_id in item_ids if self.items[item_id].req_level <= key[1]]
+            self._items_by_location_and_level[key] = items
+        return items
+
+    def item_in_location(self, item_id, location_id) -> Optional[Item]:
+        item_id = int(item_id)
+        if item_id not in self._item_ids_by_location.get(int(location_id), ()):
+            return None
+        return self.items.get(item_id)
+
+    @staticmethod
+    def _path(from_location: Location, to_location: Location, distance) -> Path:
+        return Path(
+            from_location_id=from_location.id,
+            from_location=from_location,
+            to_location_id=to_location.id,
+            to_location=to_location,
+            distance=distance,
+        )